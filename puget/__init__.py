@@ -2,6 +2,7 @@
 from . import utils
 from . import preprocess
 from . import cluster
+from . import cache
 from .version import __version__
 import os.path as op
 from .data import DATA_PATH
@@ -0,0 +1,196 @@
+"""
+On-disk cache of cleaned tables.
+
+Tables are stored as Parquet files (this requires pyarrow) named
+``<table>_<key>.parquet``, where the key is a hash of everything the table
+was computed from: the size, modification time and content of the source
+files, plus any options. If a source file changes, so does the key, and the
+stale entry is simply never read again (it is removed by `clear_cache` or
+`evict_cache`).
+"""
+import hashlib
+import json
+import os
+import os.path as op
+import glob
+import warnings
+
+import pandas as pd
+
+from .version import __version__
+
+# Read files in chunks of this many bytes when hashing their content
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+def _check_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('pyarrow is required to cache tables. Install it ' +
+                          'or call the function with cache_dir=None')
+
+
+def file_fingerprint(fname, hash_content=True):
+    """
+    Summarize the state of a file.
+
+    Parameters
+    ----------
+    fname : string
+        full path to the file
+
+    hash_content : boolean
+        whether to include a hash of the full content of the file (in
+        addition to its size & modification time). Defaults to True
+
+    Returns
+    ----------
+    list with the path, size, modification time and (optionally) content
+    hash of the file
+    """
+    stat = os.stat(fname)
+    fingerprint = [op.abspath(fname), stat.st_size, stat.st_mtime_ns]
+    if hash_content:
+        file_hash = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                file_hash.update(chunk)
+        fingerprint.append(file_hash.hexdigest())
+    return fingerprint
+
+
+def make_key(files, options=None, hash_content=True):
+    """
+    Make a cache key from a set of source files and options.
+
+    Parameters
+    ----------
+    files : list
+        full paths to all the files the table is computed from (data &
+        metadata files). Files that don't exist are ignored
+
+    options : dict
+        any other (json serializable) values that change the table
+
+    hash_content : boolean
+        whether to hash the content of the files as well as their size &
+        modification time. Defaults to True
+
+    Returns
+    ----------
+    string with the hex digest of the key
+    """
+    if options is None:
+        options = {}
+    key_spec = {'version': __version__,
+                'files': [file_fingerprint(f, hash_content=hash_content)
+                          for f in files if op.exists(f)],
+                'options': options}
+    key_str = json.dumps(key_spec, sort_keys=True, default=str)
+    return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+
+def cache_file(cache_dir, table, key):
+    """Full path of the cache file for a table & key."""
+    return op.join(cache_dir, '%s_%s.parquet' % (table, key))
+
+
+def load_table(cache_dir, table, key):
+    """
+    Read a table from the cache.
+
+    Returns
+    ----------
+    dataframe, or None if the table is not in the cache
+    """
+    _check_pyarrow()
+    fname = cache_file(cache_dir, table, key)
+    if not op.exists(fname):
+        return None
+    df = pd.read_parquet(fname)
+    # mark the file as recently used (for evict_cache)
+    os.utime(fname)
+    return df
+
+
+def save_table(df, cache_dir, table, key):
+    """
+    Write a table to the cache.
+
+    Tables that can't be stored as Parquet (e.g. with columns of mixed types)
+    are not cached, with a warning.
+    """
+    _check_pyarrow()
+    os.makedirs(cache_dir, exist_ok=True)
+    fname = cache_file(cache_dir, table, key)
+    # write to a temporary file first, so that an interrupted write never
+    # leaves a partial table that looks valid
+    temp_fname = fname + '.tmp%d' % os.getpid()
+    try:
+        df.to_parquet(temp_fname)
+    except Exception as e:
+        if op.exists(temp_fname):
+            os.remove(temp_fname)
+        warnings.warn('Could not cache the %s table: %s' % (table, e))
+        return
+    os.replace(temp_fname, fname)
+
+
+def _cache_files(cache_dir, table=None):
+    if table is None:
+        table = '*'
+    return glob.glob(op.join(cache_dir, '%s_*.parquet' % table))
+
+
+def clear_cache(cache_dir, table=None):
+    """
+    Remove cached tables.
+
+    Parameters
+    ----------
+    cache_dir : string
+        full path to the cache directory
+
+    table : string
+        name of the table to remove (e.g. 'client'). Default is None, which
+        removes all cached tables
+
+    Returns
+    ----------
+    number of files removed
+    """
+    fnames = _cache_files(cache_dir, table)
+    for fname in fnames:
+        os.remove(fname)
+    return len(fnames)
+
+
+def evict_cache(cache_dir, max_bytes):
+    """
+    Shrink the cache to at most max_bytes, removing the least recently used
+    tables first.
+
+    Parameters
+    ----------
+    cache_dir : string
+        full path to the cache directory
+
+    max_bytes : int
+        maximum total size of the cached tables
+
+    Returns
+    ----------
+    number of files removed
+    """
+    fnames = _cache_files(cache_dir)
+    stats = sorted([(os.stat(f).st_mtime, os.stat(f).st_size, f)
+                    for f in fnames], reverse=True)
+    total = 0
+    n_removed = 0
+    for mtime, size, fname in stats:
+        total += size
+        if total > max_bytes:
+            os.remove(fname)
+            n_removed += 1
+    return n_removed
@@ -3,9 +3,9 @@
 """
 import numpy as np
 import pandas as pd
-import itertools
 from scipy.sparse import csr_matrix
-import networkx as nx
+from scipy.sparse.csgraph import connected_components
+import puget.utils as pu
 
 
 def make_mapping(unique_individuals):
@@ -20,17 +20,58 @@ def make_mapping(unique_individuals):
 
     Returns
     -------
-    dict
+    Index
         A mapping between the IDs and ordinals [0,..., n], where n is
-        the number of unique IDs.
+        the number of unique IDs: the ordinal of each ID is its position in
+        the Index.
     """
-    mapping = dict(zip(unique_individuals,
-                       np.arange(unique_individuals.shape[0])))
-    return mapping
+    return pd.Index(unique_individuals)
+
+
+def map_individuals(df, individual_var, mapping=None):
+    """
+    Translate the individual IDs of every row into indices into
+    co-occurrence and distance matrices.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The data-frame with individual records to cluster.
+
+    individual_var : string
+        The variable (column) that identifies individuals.
+
+    mapping : Index or dict, optional
+        If provided, defines a mapping between individual identifiers and
+        indices (see make_mapping). Default: None, which implies the IDs are
+        numbered in order of first appearance.
+
+    Returns
+    -------
+    codes : array
+        The index of the individual of each row.
+
+    mapping : Index
+        The mapping between the IDs and indices.
+    """
+    if mapping is None:
+        codes, uniques = pd.factorize(df[individual_var])
+        mapping = pd.Index(uniques)
+    elif isinstance(mapping, dict):
+        mapping = pd.Series(mapping).sort_values()
+        if not np.array_equal(mapping.values, np.arange(mapping.shape[0])):
+            raise ValueError('mapping values must be 0, ..., n - 1')
+        mapping = mapping.index
+        codes = mapping.get_indexer(df[individual_var])
+    else:
+        codes = mapping.get_indexer(df[individual_var])
+    if np.any(codes < 0):
+        raise ValueError('Some individuals are missing or not in the mapping')
+    return codes, mapping
 
 
 def groups_co_occurrence(df, individual_var, group_var, T=None,
-                         mapping=None, sparse=None):
+                         mapping=None, sparse=None, weight=1):
     """
     Count the co-occurrence of individuals in a group.
 
@@ -51,58 +92,54 @@ def groups_co_occurrence(df, individual_var, group_var, T=None,
         connections between individuals. Default: None, which implies that
         a matrix of zeros is initialized.
 
-    mapping : dict, optional
+    mapping : Index or dict, optional
         If provided, defines a mapping between individual identifiers and
-        indices in the T array. Default: None, which implies this dict
-        is generated on the fly.
+        indices in the T array (see make_mapping). Default: None, which
+        implies this mapping is generated on the fly.
 
     sparse : bool, optional
         Whether to use a sparse CSR matrix to represent the graph.
 
+    weight : float or int, optional
+        How much each co-occurrence adds to T (default: 1).
+
     Returns
     -------
     Matrix with integer values that indicates the number of times individuals
     (mapped through mapping and inv_mapping) have appeared together in the
-    same group.
+    same group (times weight).
     """
-    unique_individuals = df[individual_var].unique()
+    individuals, mapping = map_individuals(df, individual_var, mapping)
     if T is None:
         if not sparse:
-            T = np.zeros((unique_individuals.shape[0],
-                          unique_individuals.shape[0]))
-    if mapping is None:
-        mapping = make_mapping(unique_individuals)
-    else:
-        mapping = mapping
-    gb = df.groupby(group_var)
+            T = np.zeros((mapping.shape[0], mapping.shape[0]))
+    # All pairs of individuals in the same group, from a self-merge of the
+    # (group, individual) memberships. Each individual is only counted once
+    # per group, and rows with no group are ignored (as in df.groupby):
+    members = pd.DataFrame({'group': df[group_var].values,
+                            'individual': individuals})
+    members = members.dropna(subset=['group']).drop_duplicates()
+    pairs = members.merge(members, on='group')
+    pairs = pairs[pairs['individual_x'] != pairs['individual_y']]
+    rows = pairs['individual_x'].values
+    cols = pairs['individual_y'].values
 
     if sparse:
-        rows = []
-        cols = []
-        for gid, group in gb:
-            ids = group[individual_var].unique()
-            pairs = itertools.permutations(ids, 2)
-            for pair in pairs:
-                rows.append(mapping[pair[0]])
-                cols.append(mapping[pair[1]])
-        T = csr_matrix((np.ones(len(cols)), (rows, cols)))
+        # Pairs that co-occur in several groups are summed:
+        group_T = csr_matrix((np.full(rows.shape[0], weight), (rows, cols)),
+                             shape=(mapping.shape[0], mapping.shape[0]))
+        if T is None:
+            return group_T
+        return T + group_T
     else:
-        for gid, group in gb:
-            ids = group[individual_var].unique()
-            pairs = itertools.permutations(ids, 2)
-            rows = []
-            cols = []
-            for pair in pairs:
-                rows.append(mapping[pair[0]])
-                cols.append(mapping[pair[1]])
-            T[rows, cols] = T[rows, cols] + 1
-
+        np.add.at(T, (rows, cols), weight)
 
     return T
 
 
 def time_co_occurrence(df, individual_var, time_var, time_unit='ns',
-                       time_delta=0, T=None, mapping=None):
+                       time_delta=0, T=None, mapping=None, sparse=None,
+                       weight=1, chunk_size=None):
     """
     Group by co-occurrence of the times of enrollment (entry, exit).
 
@@ -117,38 +154,110 @@ def time_co_occurrence(df, individual_var, time_var, time_unit='ns',
     time_delta : float or int
         How many of the time-unit is still considered "co-occurrence"?
         (default: 0).
+
+    T : ndarray or sparse matrix, optional
+        If provided, the co-occurrences are added to this matrix (e.g. the
+        output of groups_co_occurrence). Default: None, which implies that
+        a matrix of zeros is initialized.
+
+    sparse : bool, optional
+        Whether to use a sparse CSR matrix to represent the graph.
+
+    weight : float or int, optional
+        How much each co-occurrence adds to T (default: 1).
+
+    chunk_size : int, optional
+        If provided, pairs of enrollments are found for this many
+        enrollments at a time (in time order), and only the distinct pairs
+        of individuals are kept between chunks. This bounds the memory used
+        when many enrollments co-occur (to about twice the distinct pairs,
+        plus one chunk), and the result does not depend on chunk_size.
+        Default: None (all at once).
     """
-    unique_individuals = df[individual_var].unique()
-    if T is None:
-        T = np.zeros((unique_individuals.shape[0],
-                      unique_individuals.shape[0]))
-    if mapping is None:
-        mapping = make_mapping(unique_individuals)
-    else:
-        mapping = mapping
+    individuals, mapping = map_individuals(df, individual_var, mapping)
+    if T is None and not sparse:
+        T = np.zeros((mapping.shape[0], mapping.shape[0]))
 
     # We'll identify differences as things smaller than this:
-    dt0 = np.timedelta64(time_delta, time_unit)
+    window = np.timedelta64(time_delta, time_unit).astype(
+        'timedelta64[ns]').astype(np.int64)
+    n_individuals = np.int64(mapping.shape[0])
+    all_pairs = []
     for tv in time_var:
-        df[tv]
-        # Broadcast and get pairwise time-differences:
-        diff = np.array(df[tv])[:, None] - np.array(df[tv])[:, None].T
-        # Anything larger than the time_delta would do here:
-        diff[pd.isnull(diff)] = np.timedelta64(time_delta + 1, 'ns')
-        idx = np.where(np.abs(diff) <= dt0)
-        rows = [mapping[ii] for ii in df[individual_var][idx[0]]]
-        cols = [mapping[ii] for ii in df[individual_var][idx[1]]]
-        # Increment the co-occurence matrix where relevant:
-        T[rows, cols] = T[rows, cols] + 1
+        # Pairs of individuals are encoded as row * n_individuals + col
+        keys = np.zeros(0, dtype=np.int64)
+        # Distinct keys of the chunks that are not merged into keys yet. They
+        # are only merged when they outgrow keys, so the total cost stays
+        # O(pairs log pairs) whatever the number of chunks:
+        pending = []
+        n_pending = 0
+        times = df[tv].values.astype('datetime64[ns]')
+        for first, second in pu.window_pairs(times.view(np.int64), window,
+                                             valid=~pd.isnull(times),
+                                             chunk_size=chunk_size):
+            rows = np.concatenate([individuals[first], individuals[second]])
+            cols = np.concatenate([individuals[second], individuals[first]])
+            # Enforce self-to-self co-occurence of zero (consistent with
+            # group clustering):
+            not_self = rows != cols
+            # Individuals that co-occur more than once at this time-variable
+            # are still only counted once:
+            pending.append(np.unique(rows[not_self] * n_individuals +
+                                     cols[not_self]))
+            n_pending += pending[-1].shape[0]
+            if n_pending > keys.shape[0]:
+                keys = np.unique(np.concatenate([keys] + pending))
+                pending = []
+                n_pending = 0
+        if pending:
+            keys = np.unique(np.concatenate([keys] + pending))
+        all_pairs.append(np.stack([keys // n_individuals,
+                                   keys % n_individuals], axis=1))
+    pairs = np.concatenate(all_pairs) if all_pairs else np.zeros((0, 2), int)
 
-    # Enforce self-to-self co-occurence of zero (consistent with group
-    # clustering):
+    if sparse:
+        # Duplicate entries (pairs found in several time-variables) are
+        # summed:
+        time_T = csr_matrix((np.full(pairs.shape[0], weight),
+                             (pairs[:, 0], pairs[:, 1])),
+                            shape=(mapping.shape[0], mapping.shape[0]))
+        if T is None:
+            return time_T
+        return T + time_T
+
+    for tv_pairs in all_pairs:
+        # Increment the co-occurence matrix where relevant:
+        T[tv_pairs[:, 0], tv_pairs[:, 1]] = \
+            T[tv_pairs[:, 0], tv_pairs[:, 1]] + weight
     np.fill_diagonal(T, 0)
     return T
 
 
+def _connected_components(T):
+    """
+    Find the connected components of the graph of co-occurrences.
+
+    Parameters
+    ----------
+    T : ndarray or sparse matrix
+        The co-occurrence matrix. Any non-zero entry links two individuals.
+
+    Returns
+    -------
+    array with the cluster of each individual. Clusters are numbered
+    [1, 2, 3, ...] in order of their first individual.
+    """
+    n_components, labels = connected_components(T, directed=False)
+    # Make sure clusters are numbered in order of first appearance:
+    _, first = np.unique(labels, return_index=True)
+    order = np.empty(n_components, dtype=int)
+    order[np.argsort(first)] = np.arange(n_components)
+    return order[labels] + 1
+
+
 def cluster(df, individual_var, group_var=None, time_var=None, time_unit='ns',
-            time_delta=0, sparse=False):
+            time_delta=0, sparse=False, min_weight=1, group_weight=1,
+            time_weight=1, chunk_size=None):
     """
     Calculate clusters from a co-occurrence matrix
 
@@ -164,42 +273,254 @@ def cluster(df, individual_var, group_var=None, time_var=None, time_unit='ns',
     time_unit : string
     time_delta : float or int
     sparse : bool, optional
-        Whether to use a sparse CSR matrix to represent the graph. This may
-        slow things down, but might be necessary for really large datasets.
+        Whether to use a sparse CSR matrix to represent the graph (for both
+        group and time co-occurrence). This may slow things down, but might
+        be necessary for really large datasets.
+    min_weight : float or int, optional
+        Individuals are only linked if their (weighted) co-occurrence count
+        is at least this (default: 1, any co-occurrence links individuals).
+    group_weight : float or int, optional
+        How much each group co-occurrence counts (default: 1).
+    time_weight : float or int, optional
+        How much each time co-occurrence counts (default: 1).
+    chunk_size : int, optional
+        Find time co-occurrences for this many enrollments at a time (see
+        time_co_occurrence).
     """
-    unique_individuals = df[individual_var].unique()
+    individuals, mapping = map_individuals(df, individual_var)
 
     if sparse:
         T = None
     else:
-        T = np.zeros((unique_individuals.shape[0],
-                      unique_individuals.shape[0]))
-
-    mapping = make_mapping(unique_individuals)
+        T = np.zeros((mapping.shape[0], mapping.shape[0]))
 
     if group_var is not None:
         T = groups_co_occurrence(df, individual_var, group_var, T=T,
-                                 mapping=mapping, sparse=sparse)
+                                 mapping=mapping, sparse=sparse,
+                                 weight=group_weight)
 
     if time_var is not None:
-        if sparse:
-            raise NotImplementedError("""Can't use sparse matrices with
-                                         time variable""")
         T = time_co_occurrence(df, individual_var, time_var,
                                time_unit=time_unit,
                                time_delta=time_delta,
-                               T=T, mapping=mapping)
+                               T=T, mapping=mapping, sparse=sparse,
+                               weight=time_weight, chunk_size=chunk_size)
+
+    if T is None:
+        T = csr_matrix((mapping.shape[0], mapping.shape[0]))
+    # Drop the links that are too weak before finding the components:
+    if sparse:
+        T = T.tocsr()
+        T.data[T.data < min_weight] = 0
+        T.eliminate_zeros()
+    else:
+        T[T < min_weight] = 0
+
+    clusters = _connected_components(T)
+    df['cluster'] = clusters[individuals]
+    return df
+
 
-    clusters = {}
-    if not sparse:
-        T[np.tril_indices(T.shape[0])] = 0
-        G = nx.Graph(T)
+def _union(parents, rows, cols):
+    """
+    Merge the components of each pair of individuals.
+
+    Parameters
+    ----------
+    parents : array
+        The root of the component of each individual. Roots are the smallest
+        index in their component (so roots are their own parent).
+
+    rows, cols : array
+        The indices of the pairs of individuals to link.
+
+    Returns
+    -------
+    The updated parents array.
+    """
+    if rows.shape[0] == 0:
+        return parents
+    # Only the components that are touched by a link need to be merged:
+    roots, ends = np.unique(np.concatenate([parents[rows], parents[cols]]),
+                            return_inverse=True)
+    G = csr_matrix((np.ones(rows.shape[0]),
+                    (ends[:rows.shape[0]], ends[rows.shape[0]:])),
+                   shape=(roots.shape[0], roots.shape[0]))
+    n_components, labels = connected_components(G, directed=False)
+    new_roots = np.full(n_components, parents.shape[0])
+    np.minimum.at(new_roots, labels, roots)
+    relabel = np.arange(parents.shape[0])
+    relabel[roots] = new_roots[labels]
+    return relabel[parents]
+
+
+def _link_to_representatives(representatives, keys, individuals):
+    """
+    Find the representative individual of each key (a group or a time),
+    adding the keys that have not been seen yet, with their first individual
+    as representative.
+
+    Returns
+    -------
+    The updated representatives Series and the representative of each key.
+    """
+    members = pd.Series(individuals, index=keys)
+    new = members[~members.index.isin(representatives.index)]
+    new = new[~new.index.duplicated()]
+    representatives = pd.concat([representatives, new])
+    reps = representatives.values[representatives.index.get_indexer(keys)]
+    return representatives, reps
+
+
+def make_cluster_state(individual_var, group_var=None, time_var=None,
+                       time_unit='ns', time_delta=0):
+    """
+    Create an empty clustering state, to be updated with enrollments in
+    batches (e.g. from each monthly extract) with update_cluster_state.
+
+    Clusters are the same as the ones found by `cluster` on all the
+    enrollments at once (with the default min_weight and weights): any
+    co-occurrence links two individuals.
+
+    Parameters
+    ----------
+    individual_var : string
+        A variable that identifies individuals
+    group_var : string
+        A variable to cluster on group co-occurrence
+    time_var : list
+        The variables to cluster on temporal co-occurrence
+    time_unit : string
+    time_delta : float or int
+
+    Returns
+    -------
+    dict with the clustering options, the mapping of individual IDs to
+    indices, the root of the component of each individual and a
+    representative individual for each group and time seen so far.
+    """
+    if time_var is None:
+        time_var = []
+    window = np.timedelta64(time_delta, time_unit).astype(
+        'timedelta64[ns]').astype(np.int64)
+    return {'individual_var': individual_var,
+            'group_var': group_var,
+            'time_var': list(time_var),
+            'window': window,
+            'mapping': pd.Index([]),
+            'parents': np.zeros(0, dtype=int),
+            'groups': pd.Series([], dtype=int),
+            'times': {tv: pd.Series([], dtype=int) for tv in time_var}}
+
+
+def update_cluster_state(state, df):
+    """
+    Add new enrollments to a clustering state.
+
+    Instead of the full co-occurrence graph, each individual is only linked
+    to a representative of each of their groups and times, and each time to
+    the closest earlier and later times (if they are within time_delta).
+    These links connect the same components, so an update only costs time
+    proportional to the new enrollments (plus one vectorized pass over the
+    parents of all individuals).
+
+    Parameters
+    ----------
+    state : dict
+        The clustering state (see make_cluster_state). It is not modified.
+    df : DataFrame
+        The new enrollments
+
+    Returns
+    -------
+    The updated state.
+    """
+    state = dict(state)
+    individual_var = state['individual_var']
+    ids = df[individual_var]
+    if ids.isnull().any():
+        raise ValueError('Some individuals are missing')
+    new_ids = pd.unique(ids[~ids.isin(state['mapping'])])
+    state['mapping'] = state['mapping'].append(pd.Index(new_ids))
+    n_old = state['parents'].shape[0]
+    parents = np.concatenate([state['parents'],
+                              np.arange(n_old, n_old + new_ids.shape[0])])
+    individuals = state['mapping'].get_indexer(ids)
+
+    rows = []
+    cols = []
+    if state['group_var'] is not None:
+        groups = df[state['group_var']].values
+        has_group = ~pd.isnull(groups)
+        state['groups'], reps = _link_to_representatives(
+            state['groups'], groups[has_group], individuals[has_group])
+        rows.append(individuals[has_group])
+        cols.append(reps)
+
+    state['times'] = dict(state['times'])
+    for tv in state['time_var']:
+        times = df[tv].values
+        has_time = ~pd.isnull(times)
+        times = times[has_time].astype('datetime64[ns]').view(np.int64)
+        is_new = ~np.isin(times, state['times'][tv].index)
+        representatives, reps = _link_to_representatives(
+            state['times'][tv], times, individuals[has_time])
+        representatives = representatives.sort_index()
+        state['times'][tv] = representatives
+        rows.append(individuals[has_time])
+        cols.append(reps)
+
+        # Link each new time to its neighbours in time, if they co-occur:
+        sorted_times = representatives.index.values
+        new_pos = representatives.index.get_indexer(np.unique(times[is_new]))
+        for neighbour in [new_pos - 1, new_pos + 1]:
+            ok = (neighbour >= 0) & (neighbour < sorted_times.shape[0])
+            pos, neighbour = new_pos[ok], neighbour[ok]
+            close = (np.abs(sorted_times[neighbour] - sorted_times[pos]) <=
+                     state['window'])
+            rows.append(representatives.values[pos[close]])
+            cols.append(representatives.values[neighbour[close]])
+
+    if len(rows):
+        state['parents'] = _union(parents, np.concatenate(rows).astype(int),
+                                  np.concatenate(cols).astype(int))
     else:
-        G = nx.from_scipy_sparse_matrix(T)
+        state['parents'] = parents
+    return state
 
-    for i, c in enumerate(nx.connected_components(G)):
-        for j in c:
-            clusters[j] = i + 1
 
-    df['cluster'] = df[individual_var].apply(lambda x: clusters[mapping[x]])
+def get_clusters(state, df):
+    """
+    Assign the clusters of a clustering state to enrollments.
+
+    Clusters are numbered [1, 2, 3, ...] in order of their first individual
+    (in the order individuals were added to the state), as in `cluster`.
+
+    Parameters
+    ----------
+    state : dict
+        The clustering state (see make_cluster_state)
+    df : DataFrame
+        Enrollments of individuals that are in the state
+
+    Returns
+    -------
+    df with a 'cluster' column
+    """
+    individuals, _ = map_individuals(df, state['individual_var'],
+                                     state['mapping'])
+    # Roots are the first individual of their component:
+    roots = np.unique(state['parents'])
+    df['cluster'] = np.searchsorted(roots,
+                                    state['parents'][individuals]) + 1
     return df
+
+
+def save_cluster_state(state, fname):
+    """Save a clustering state to a (pickle) file."""
+    pd.to_pickle(state, fname)
+
+
+def load_cluster_state(fname):
+    """Load a clustering state saved with save_cluster_state."""
+    return pd.read_pickle(fname)
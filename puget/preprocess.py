@@ -27,11 +27,16 @@ The raw data is provided in the following format:
 
 import pandas as pd
 import datetime
+import os
 import os.path as op
 import numpy as np
 import json
+import re
 import puget.utils as pu
+import puget.cache as pc
 import warnings
+import functools
+import inspect
 
 from puget.data import DATA_PATH
 
@@ -82,6 +87,11 @@ file_path_boilerplate = (
     paths : list
         list of directories inside data_dir to look for csv files in;
             not required if file_spec is a dictionary
+
+    n_jobs : int
+        number of csv files to read concurrently. Default is 1 (read the
+            files one after another). Values < 1 use all the cores, and
+            there are never more workers than cores or files
     """)
 
 metdata_boilerplate = (
@@ -89,6 +99,16 @@ metdata_boilerplate = (
     metadata_file : string
         name of json metadata file with lists of columns to use for
         deduplication, columns to drop, categorical and time-like columns
+        and (optionally) a dtype dict with explicit column types
+    """)
+
+cache_boilerplate = (
+    """
+    cache_dir : string
+        full path to a directory to cache the output table in (see
+        puget.cache). If the source files, metadata and other arguments are
+        unchanged since the table was cached, it is read from there instead
+        of being recomputed. Default is None (no caching)
     """)
 
 
@@ -119,11 +139,85 @@ def std_path_setup(filename, data_dir, paths):
     return file_spec
 
 
+def setup_file_spec(file_spec, county=None, data_dir=None, paths=None):
+    """
+    Get the full file names of a table from the file_spec, county, data_dir
+    and paths arguments of read_table (see there).
+
+    Returns
+    ----------
+    dict with key of paths, value of filenames for all included folders
+    """
+    if not isinstance(file_spec, dict):
+        if data_dir is None:
+            if county is None:
+                raise ValueError('If file_spec is a string, data_dir or ' +
+                                 'county must be passed')
+            else:
+                if not isinstance(county, str):
+                    raise ValueError('county must be a string -- '
+                                     'one county at a time, please!')
+                data_dir = op.join(DATA_PATH, county)
+        if paths is None:
+            if county is None:
+                raise ValueError('If file_spec is a string, paths or county ' +
+                                 'must be passed')
+            else:
+                if not isinstance(county, str):
+                    raise ValueError('county must be a string -- '
+                                     'one county at a time, please!')
+                paths = COUNTY_FOLDERS[county]
+
+        file_spec = std_path_setup(file_spec, data_dir, paths)
+    else:
+        if data_dir is not None or paths is not None:
+            raise ValueError(
+                'If file_spec is a dict, data_dir and paths cannot be passed')
+    return file_spec
+
+
+def _strip_bom(col):
+    """
+    Remove the unicode 'zero width no-break space character'
+    (http://www.fileformat.info/info/unicode/char/FEFF/index.htm) that is
+    sometimes prepended to column headers.
+    """
+    if col.startswith('\ufeff'):
+        return col[1:]
+    return col
+
+
+def _read_csv(fname, encoding=None, columns_to_drop=None, dtype=None):
+    """
+    Read a single raw csv file, skipping columns_to_drop while parsing and
+    parsing the columns in dtype directly into the given types.
+
+    This lives at the module level (rather than inside read_table) so that it
+    can be sent to worker processes.
+    """
+    if columns_to_drop:
+        drop = set(columns_to_drop)
+
+        # Columns are matched on their cleaned-up header, so that a header
+        # with a BOM still gets dropped
+        def usecols(col): return _strip_bom(col) not in drop
+    else:
+        usecols = None
+    if dtype:
+        # Also type columns whose header has a BOM
+        dtype = dict(dtype, **{'\ufeff' + k: v for k, v in dtype.items()})
+    else:
+        dtype = None
+    return pd.read_csv(fname, low_memory=False, encoding=encoding,
+                       usecols=usecols, dtype=dtype)
+
+
 def read_table(file_spec, county=None, data_dir=None, paths=None,
                columns_to_drop=None, categorical_var=None,
                categorical_unknown=CATEGORICAL_UNKNOWN,
                time_var=None, duplicate_check_columns=None, dedup=True,
-               encoding=None, name_columns=None):
+               encoding=None, name_columns=None, dtype=None, n_jobs=1,
+               executor='thread'):
     """
     Read in any .csv table from multiple folders in the raw data.
 
@@ -131,8 +225,13 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
     ----------
     %s
 
+    executor : string
+        'thread' or 'process': the kind of worker pool used to read the files
+        when n_jobs is not 1. Default is 'thread'
+
     columns_to_drop : list
-        A list of of columns to drop. The default is None.
+        A list of of columns to drop. The default is None. These columns are
+        skipped while parsing the csv files, so they are never loaded.
 
     categorical_var : list
         A list of categorical (including binary) variables where values
@@ -146,6 +245,13 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
         A list of time (variables) in yyyy-mm-dd format that are
         reformatted into pandas timestamps. Default is None.
 
+    dtype : dict
+        Explicit types for some columns, applied while parsing. Keys are
+        column names, values are pandas dtype names, e.g. 'Int8' (small
+        nullable integers, for the numeric codes in categorical_var),
+        'category' or 'string'. Columns not listed here are inferred.
+        Default is None.
+
     duplicate_check_columns : list
         list of columns to conside in deduplication.
           Generally, duplicate rows may happen when the same record is
@@ -164,54 +270,44 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
         categorical_var = []
     if time_var is None:
         time_var = []
-
-    if not isinstance(file_spec, dict):
-        if data_dir is None:
-            if county is None:
-                raise ValueError('If file_spec is a string, data_dir or ' +
-                                 'county must be passed')
-            else:
-                if not isinstance(county, str):
-                    raise ValueError('county must be a string -- '
-                                     'one county at a time, please!')
-                data_dir = op.join(DATA_PATH, county)
-        if paths is None:
-            if county is None:
-                raise ValueError('If file_spec is a string, paths or county ' +
-                                 'must be passed')
-            else:
-                if not isinstance(county, str):
-                    raise ValueError('county must be a string -- '
-                                     'one county at a time, please!')
-                paths = COUNTY_FOLDERS[county]
-
-        file_spec = std_path_setup(file_spec, data_dir, paths)
+    if dtype is None:
+        dtype = {}
+
+    file_spec = setup_file_spec(file_spec, county=county, data_dir=data_dir,
+                                paths=paths)
+
+    # The last file in file_spec goes first, followed by the rest in order.
+    # Deduplication keeps the 'last' record, so this ordering is part of the
+    # output and has to be the same whether or not the files are read in
+    # parallel.
+    fnames = list(file_spec.values())
+    fnames = fnames[-1:] + fnames[:-1]
+
+    read_kwargs = dict(encoding=encoding, columns_to_drop=columns_to_drop,
+                       dtype=dtype)
+    dfs = pu.run_in_pool(_read_csv, [((fname,), read_kwargs)
+                                     for fname in fnames],
+                         n_jobs=n_jobs, executor=executor)
+
+    # Join all the files at once, rather than appending one at a time
+    if len(dfs) == 1:
+        df = dfs[0]
     else:
-        if data_dir is not None or paths is not None:
-            raise ValueError(
-                'If file_spec is a dict, data_dir and paths cannot be passed')
-
-    file_spec_use = file_spec.copy()
-
-    # Start by reading the first file into a DataFrame
-    path, fname = file_spec_use.popitem()
-    df = pd.read_csv(fname, low_memory=False, encoding=encoding)
-
-    # Then, for the rest of the files, append to the DataFrame.
-    for path, fname in file_spec_use.items():
-        this_df = pd.read_csv(fname, low_memory=False, encoding=encoding)
-        df = df.append(this_df)
+        df = pd.concat(dfs, sort=False)
+    del dfs
 
     # Sometimes, column headers can have the unicode 'zero width no-break space
-    # character' (http://www.fileformat.info/info/unicode/char/FEFF/index.htm)
-    # appended to them (because, why not?). We eliminate that here:
-    for col in df.columns:
-        if col.startswith('\ufeff'):
-            df.rename(columns={col: col[1:]}, inplace=True)
-
-    # Drop unnecessary columns
-    cols_drop_use = list(set(columns_to_drop).intersection(set(df.columns)))
-    df = df.drop(cols_drop_use, axis=1)
+    # character' appended to them (because, why not?). We eliminate that here.
+    # Unnecessary columns (columns_to_drop) were already skipped while
+    # parsing, so they never get loaded into memory.
+    df = df.rename(columns=_strip_bom)
+
+    # Categoricals read from different files usually have different
+    # categories, and concatenating them gives back object columns, so make
+    # sure every column ends up with the type it was asked for
+    for col, col_dtype in dtype.items():
+        if col in df.columns and df[col].dtype != col_dtype:
+            df[col] = df[col].astype(col_dtype)
 
     # Drop duplicates
     if dedup:
@@ -224,8 +320,22 @@ def read_table(file_spec, county=None, data_dir=None, paths=None,
 
     # Turn values in categorical_unknown in any categorical_var into NaNs
     for col in categorical_var:
-        df[col] = df[col].replace(categorical_unknown,
-                                  [np.NaN, np.NaN, np.NaN])
+        if col in dtype:
+            # masking (rather than replacing) keeps the type from dtype.
+            # 'category' and 'string' columns hold the codes as text, so
+            # compare their numeric values against categorical_unknown
+            if df[col].dtype == 'category':
+                categories = df[col].cat.categories
+                codes = pd.to_numeric(pd.Series(categories), errors='coerce')
+                unknown = categories[codes.isin(categorical_unknown).values]
+                df[col] = df[col].mask(df[col].isin(unknown))
+                df[col] = df[col].cat.remove_unused_categories()
+            else:
+                codes = pd.to_numeric(df[col].astype(object), errors='coerce')
+                df[col] = df[col].mask(codes.isin(categorical_unknown))
+        else:
+            df[col] = df[col].replace(categorical_unknown,
+                                      [np.NaN, np.NaN, np.NaN])
 
     # Reformat yyyy-mm-dd variables to pandas timestamps
     for col in time_var:
@@ -242,17 +352,25 @@ def split_rows_to_columns(df, category_column, category_suffix, merge_columns):
     (coded as numerical values) and other columns containing the measurements
     at entry/exit
 
+    Several category columns (e.g. collection stage and disability type) can
+    be split in a single pass. The result is the same as an outer merge on
+    merge_columns of the rows for each category value, one after the other:
+    one row per merge_columns value, unless there are several rows for the
+    same category value, in which case all their combinations are kept.
+
     Parameters
     ----------
     df: dataframe
         input dataframe
 
-    category_column : string
-        name of column containing the categories to be remapped to columns
+    category_column : string or list
+        name(s) of column(s) containing the categories to be remapped to
+        columns
 
-    category_suffix : dict
+    category_suffix : dict or list
         keys are values in category_column, values are suffixes to attach to
-        the column for that category
+        the column for that category. A list of dicts (one per column) if
+        category_column is a list; suffixes are attached in the same order
 
     merge_columns: list or string
         name(s) of column(s) containing to merge on.
@@ -261,40 +379,94 @@ def split_rows_to_columns(df, category_column, category_suffix, merge_columns):
     ----------
     new dataframe with response columns split into *_entry and *_exit columns
     """
-    columns_to_rename = list(df.columns.values)
     if isinstance(merge_columns, list):
-        for col in merge_columns:
-            columns_to_rename.remove(col)
+        merge_columns = list(merge_columns)
     else:
-        columns_to_rename.remove(merge_columns)
+        merge_columns = [merge_columns]
 
-    if isinstance(category_column, (list, tuple)):
+    if isinstance(category_column, list):
+        category_columns = category_column
+        category_suffixes = category_suffix
+    elif isinstance(category_column, tuple):
         e_s = "The type column (e.g. 'CollectionStage') needs to be defined as"
         e_s += "a single string in the relevant metadata file. Cannot be a "
         e_s += "container!"
         raise TypeError(e_s)
-
-    columns_to_rename.remove(category_column)
-
-    # group by each type in turn
-    gb = df.groupby(category_column)
-    for index, tpl in enumerate(gb):
-        name, group = tpl
-        rename_dict = dict(zip(
-            columns_to_rename,
-            [s + category_suffix[name] for s in columns_to_rename]))
-        this_df = group.rename(columns=rename_dict).drop(category_column,
-                                                         axis=1)
-        if index == 0:
-            df_wide = this_df
-        else:
-            df_wide = pd.merge(df_wide, this_df, how='outer',
-                               left_on=merge_columns, right_on=merge_columns)
+    else:
+        category_columns = [category_column]
+        category_suffixes = [category_suffix]
+
+    if (not isinstance(category_suffixes, list) or
+            len(category_suffixes) != len(category_columns)):
+        raise TypeError('category_suffix must be a list with one dict per ' +
+                        'column in category_column')
+
+    columns_to_rename = [c for c in df.columns.values
+                         if c not in merge_columns + category_columns]
+
+    # rows without a category can't be put in any column
+    df = df.dropna(subset=category_columns).reset_index(drop=True)
+    if len(df) == 0:
+        return df[merge_columns]
+
+    # integer codes for the merge keys and the category values (or
+    # combinations of values), both in sorted order
+    key_gb = df.groupby(merge_columns, sort=True, dropna=False)
+    key_codes = key_gb.ngroup().values
+    n_keys = key_gb.ngroups
+    category_gb = df.groupby(category_columns, sort=True)
+    category_codes = category_gb.ngroup().values
+    categories = category_gb.size().index
+    n_categories = len(categories)
+
+    # number of rows per key per category, and where they start in the rows
+    # sorted by category then key (stable, so keeping their original order)
+    flat_codes = category_codes * n_keys + key_codes
+    counts = np.bincount(flat_codes, minlength=n_categories * n_keys)
+    offsets = (np.cumsum(counts) - counts).reshape(n_categories, n_keys)
+    counts = counts.reshape(n_categories, n_keys)
+    order = np.argsort(flat_codes, kind='stable')
+
+    # each key gets one row per combination of its rows in every category
+    # (a missing category counts as one row of NaNs), with the first category
+    # varying slowest
+    radix = np.maximum(counts, 1)
+    strides = np.ones_like(radix)
+    for c in range(n_categories - 2, -1, -1):
+        strides[c] = strides[c + 1] * radix[c + 1]
+    n_rows = strides[0] * radix[0]
+    out_keys = np.repeat(np.arange(n_keys), n_rows)
+    out_pos = np.arange(len(out_keys)) - np.repeat(np.cumsum(n_rows) - n_rows,
+                                                   n_rows)
+
+    # a row to take the merge_columns from, for each key
+    key_rows = np.empty(n_keys, dtype=int)
+    key_rows[key_codes] = np.arange(len(df))
+    df_wide = [df.loc[key_rows[out_keys], merge_columns].reset_index(drop=True)]
+
+    values = df[columns_to_rename]
+    for c, category in enumerate(categories):
+        if not isinstance(category, tuple):
+            category = (category,)
+        suffix = ''.join([sfx[cat] for sfx, cat
+                          in zip(category_suffixes, category)])
+        digit = (out_pos // strides[c, out_keys]) % radix[c, out_keys]
+        rows = np.where(counts[c, out_keys] > 0,
+                        order[np.minimum(offsets[c, out_keys] + digit,
+                                         len(order) - 1)], -1)
+        # rows is -1 where the key has no rows in this category, which
+        # reindex turns into NaNs
+        this_df = values.reindex(rows).reset_index(drop=True)
+        this_df.columns = [s + suffix for s in columns_to_rename]
+        df_wide.append(this_df)
+
+    df_wide = pd.concat(df_wide, axis=1)
     return df_wide
 
 
 def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
-                          paths=None, suffixes=ENTRY_EXIT_SUFFIX):
+                          paths=None, suffixes=ENTRY_EXIT_SUFFIX, n_jobs=1,
+                          category_columns=None, category_suffixes=None):
     """
     Read in tables with entry & exit values, convert entry & exit rows to
     columns
@@ -312,6 +484,15 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
 
     %s
 
+    category_columns : list
+        other columns (e.g. disability type) to convert to columns in the
+        same pass as the collection stage. Default is None
+
+    category_suffixes : list
+        one dict per column in category_columns, with keys that are values in
+        the column and values that are suffixes to attach after the
+        entry/exit suffix
+
     Returns
     ----------
     dataframe with one row per person per enrollment -- rows containing
@@ -335,7 +516,7 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
             raise ValueError(k + ' entry must be present in metadata file')
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    n_jobs=n_jobs, **metadata)
 
     # Don't use the update stage data:
     df = df[(df[extra_metadata['collection_stage_column']] !=
@@ -343,9 +524,16 @@ def read_entry_exit_table(metadata, county=None, file_spec=None, data_dir=None,
             (df[extra_metadata['collection_stage_column']] != extra_metadata['annual_assessment_stage_val']) &
             (df[extra_metadata['collection_stage_column']] != extra_metadata['post_exit_stage_val'])]
 
-    df_wide = split_rows_to_columns(df, extra_metadata['collection_stage_column'],
-                                    dict(zip([extra_metadata['entry_stage_val'],
-                                              extra_metadata['exit_stage_val']], suffixes)),
+    if category_columns is None:
+        category_columns = []
+        category_suffixes = []
+
+    stage_suffix = dict(zip([extra_metadata['entry_stage_val'],
+                             extra_metadata['exit_stage_val']], suffixes))
+    df_wide = split_rows_to_columns(df,
+                                    [extra_metadata['collection_stage_column']] +
+                                    list(category_columns),
+                                    [stage_suffix] + list(category_suffixes),
                                     extra_metadata['person_enrollment_ID'])
 
     return df_wide
@@ -362,8 +550,69 @@ def get_metadata_dict(metadata_file):
     return metadata
 
 
+def _cached_table(table, default_file, extra_files=None):
+    """
+    Decorator that adds a cache_dir argument to a get_* function.
+
+    When cache_dir is passed, the output is looked up in the cache (see
+    puget.cache) under a key made from the csv files, any *_file arguments
+    (metadata & mapping files), extra_files and the remaining arguments, and
+    only computed (and stored) if it is not there.
+
+    Parameters
+    ----------
+    table : string
+        name of the table in the cache
+
+    default_file : string
+        the file_spec the function uses when file_spec is None
+
+    extra_files : list
+        other files the output depends on
+    """
+    if extra_files is None:
+        extra_files = []
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, cache_dir=None, **kwargs):
+            if cache_dir is None:
+                return func(*args, **kwargs)
+
+            call = signature.bind(*args, **kwargs)
+            call.apply_defaults()
+            options = dict(call.arguments)
+            file_spec = options.pop('file_spec')
+            if file_spec is None:
+                file_spec = default_file
+            file_spec = setup_file_spec(file_spec,
+                                        county=options.pop('county'),
+                                        data_dir=options.pop('data_dir'),
+                                        paths=options.pop('paths'))
+            # n_jobs only changes how fast the table is read
+            options.pop('n_jobs', None)
+
+            files = list(file_spec.values()) + extra_files
+            for k in list(options.keys()):
+                if k.endswith('_file'):
+                    files.append(options.pop(k))
+            key = pc.make_key([f for f in files if f is not None], options)
+
+            df = pc.load_table(cache_dir, table, key)
+            if df is None:
+                df = func(*args, **kwargs)
+                pc.save_table(df, cache_dir, table, key)
+            return df
+        return wrapper
+    return decorator
+
+
+@_cached_table('enrollment', 'Enrollment.csv')
 def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
-                   paths=None, metadata_file=METADATA_FILES['enrollment']):
+                   paths=None, metadata_file=METADATA_FILES['enrollment'],
+                   n_jobs=1):
     """
     Read in the raw Enrollment tables.
 
@@ -376,6 +625,8 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
 
     %s
 
+    %s
+
     groups : boolean
         If true, only return rows for groups (>1 person)
 
@@ -395,7 +646,7 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
     entry_date_column = metadata.pop('entry_date')
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    n_jobs=n_jobs, **metadata)
     # Now, group by HouseholdID, and only keep the groups where there are
     # more than one ProjectEntryID.
     # The new dataframe should represent families
@@ -411,12 +662,15 @@ def get_enrollment(county=None, groups=True, file_spec=None, data_dir=None,
 
     return df
 
-get_enrollment.__doc__ = get_enrollment.__doc__ % (file_path_boilerplate,
-                                                   metdata_boilerplate)
+get_enrollment.__doc__ = get_enrollment.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('exit', 'Exit.csv',
+               extra_files=[op.join(pu.METADATA,
+                                    'destination_mappings.csv')])
 def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
-             metadata_file=METADATA_FILES['exit']):
+             metadata_file=METADATA_FILES['exit'], n_jobs=1):
     """
     Read in the raw Exit tables and map destinations.
 
@@ -426,6 +680,8 @@ def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing exit record of a person per enrollment
@@ -437,20 +693,72 @@ def get_exit(county=None, file_spec=None, data_dir=None, paths=None,
     df_destination_column = metadata.pop('destination_column')
     enid_column = metadata.pop('person_enrollment_ID')
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    n_jobs=n_jobs, **metadata)
 
     df_merge = pu.merge_destination(
         df, df_destination_column=df_destination_column)
 
     return df_merge
 
-get_exit.__doc__ = get_exit.__doc__ % (file_path_boilerplate,
-                                       metdata_boilerplate)
+get_exit.__doc__ = get_exit.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+def _resolve_conflicts(df, pid_column, cols, kind):
+    """
+    Set all the rows of a person to the same value, for people with more
+    than one row whose rows are not all identical (counting NaN as a value).
+    df is changed in place.
+
+    Parameters
+    ----------
+    df : dataframe
+
+    pid_column : string
+        name of the column identifying people
+
+    cols : list
+        columns to resolve
+
+    kind : string
+        how conflicting values are resolved. In all cases a person with a
+        single valid value gets that value in all rows, otherwise:
+        'time': if the difference is less than a year take the midpoint,
+            otherwise set to NaT
+        'boolean': if ever true then set to true
+        'numeric': set to NaN
+    """
+    multi = df[pid_column].notnull() & df[pid_column].duplicated(keep=False)
+    if not multi.any():
+        return
+    gb = df.loc[multi].groupby(pid_column)
+
+    for col in cols:
+        conflict = gb[col].transform('nunique', dropna=False) > 1
+        if not conflict.any():
+            continue
+        n_valid = gb[col].transform('count')
+        if kind == 'time':
+            t_min = gb[col].transform('min')
+            t_diff = (gb[col].transform('max') - t_min).dt.floor('s')
+            midpoint = (t_min + t_diff / 2).dt.floor('D')
+            one_valid = t_min
+            many_valid = midpoint.where(t_diff < datetime.timedelta(365))
+        elif kind == 'boolean':
+            one_valid = many_valid = gb[col].transform('max')
+        elif kind == 'numeric':
+            one_valid = gb[col].transform('max')
+            many_valid = pd.Series(np.nan, index=one_valid.index)
+        else:
+            raise ValueError('kind must be one of time, boolean or numeric')
+        new_val = many_valid.where(n_valid > 1, one_valid)
+        df.loc[conflict[conflict].index, col] = new_val[conflict]
+
+
+@_cached_table('client', 'Client.csv')
 def get_client(county=None, file_spec=None, data_dir=None, paths=None,
                metadata_file=METADATA_FILES['client'],
-               name_exclusion=False):
+               name_exclusion=False, n_jobs=1):
     """
     Read in the raw Client tables.
 
@@ -460,6 +768,8 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing demographic information of a person
@@ -497,64 +807,17 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
                               [pid_column]))
 
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    duplicate_check_columns=mid_dedup_cols, **metadata)
+                    duplicate_check_columns=mid_dedup_cols, n_jobs=n_jobs,
+                    **metadata)
     df = df.set_index(np.arange(df.shape[0]))
 
-    # iterate through people with more than one entry and resolve differences.
-    # Set all rows to the same sensible value
-    gb = df.groupby(pid_column)
-    n_entries = gb.size()
-    for pid, group in gb:
-        # turn off SettingWithCopy warning for this object
-        group.is_copy = False
-
-        if n_entries.loc[pid] > 1:
-            # for differences in time columns, if the difference is less than
-            # a year then take the midpoint, otherwise set to NaN
-            for col in metadata['time_var']:
-                if col == dob_column:
-                    continue
-                if len(np.unique(group[col])) > 1:
-                    is_valid = ~pd.isnull(group[col])
-                    n_valid = np.sum(is_valid)
-                    if n_valid == 1:
-                        group[col] = group[col][is_valid].values[0]
-                    elif n_valid > 1:
-                        t_diff = np.max(group[col]) - np.min(group[col])
-                        if t_diff < datetime.timedelta(365):
-                            t_diff_sec = t_diff.seconds + 86400 * t_diff.days
-                            new_date = (np.min(group[col]) +
-                                        datetime.timedelta(
-                                            seconds=t_diff_sec / 2.)).date()
-                            group[col] = pd.datetime(new_date.year,
-                                                     new_date.month,
-                                                     new_date.day)
-                        else:
-                            group[col] = pd.NaT
-
-            # for differences in boolean columns, if ever true then set to true
-            for col in boolean_cols:
-                if len(np.unique(group[col])) > 1:
-                    is_valid = ~pd.isnull(group[col])
-                    n_valid = np.sum(is_valid)
-                    if n_valid == 1:
-                        group[col] = group[col][is_valid].values[0]
-                    elif n_valid > 1:
-                        group[col] = np.max(group[col][is_valid])
-
-            # for differences in numeric type columns, if there are conflicting
-            # valid answers, set to NaN
-            for col in numeric_cols:
-                if len(np.unique(group[col])) > 1:
-                    is_valid = ~pd.isnull(group[col])
-                    n_valid = np.sum(is_valid)
-                    if n_valid == 1:
-                        group[col] = group[col][is_valid].values[0]
-                    elif n_valid > 1:
-                        group[col] = np.nan
-
-            # push these changes back into the dataframe
-            df.iloc[np.where(df[pid_column] == pid)[0]] = group
+    # Resolve differences between the rows of people with more than one entry
+    # and set all their rows to the same sensible value
+    _resolve_conflicts(df, pid_column,
+                       [c for c in metadata['time_var'] if c != dob_column],
+                       'time')
+    _resolve_conflicts(df, pid_column, boolean_cols, 'boolean')
+    _resolve_conflicts(df, pid_column, numeric_cols, 'numeric')
 
     # Now all rows with the same pid_column have identical time_var,
     # boolean & numeric_col values so we can perform full deduplication
@@ -567,23 +830,21 @@ def get_client(county=None, file_spec=None, data_dir=None, paths=None,
 
     if name_exclusion:
         name_cols = metadata.pop('name_columns')
-        df['exclude_by_name'] = df.apply(_name_exclude,
-                                        args=[name_cols, NAME_EXCLUSION],
-                                        axis=1)
         # The function returns True for keepers:
-        df = df[df["exclude_by_name"]]
-        df.drop(['exclude_by_name'], axis=1, inplace=True)
+        df = df[_name_exclude(df, name_cols, NAME_EXCLUSION)]
 
     return df
 
-get_client.__doc__ = get_client.__doc__ % (file_path_boilerplate,
-                                           metdata_boilerplate)
+get_client.__doc__ = get_client.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('disabilities', 'Disabilities.csv')
 def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
                      metadata_file=METADATA_FILES['disabilities'],
                      disability_type_file=op.join(DATA_PATH, 'metadata',
-                                                  'disability_type.json')):
+                                                  'disability_type.json'),
+                     n_jobs=1):
     """
     Read in the raw Disabilities tables, convert sets of disablity type
     and response rows to columns to reduce to one row per
@@ -595,6 +856,8 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
 
     %s
 
+    %s
+
     disability_type_file : string
         name of json file with mapping between disability numeric codes and
         string description
@@ -619,34 +882,22 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
 
     extra_metadata['person_enrollment_ID'] = metadata['person_enrollment_ID']
 
-    stage_suffixes = ENTRY_EXIT_SUFFIX
-    df_stage = read_entry_exit_table(metadata, county=county,
-                                     file_spec=file_spec, data_dir=data_dir,
-                                     paths=paths, suffixes=stage_suffixes)
-
     mapping_dict = get_metadata_dict(disability_type_file)
     # convert to integer keys
     mapping_dict = {int(k): v for k, v in mapping_dict.items()}
-
     type_suffixes = ['_' + s for s in mapping_dict.values()]
-    merge_columns = [extra_metadata['person_enrollment_ID'],
-                     extra_metadata['type_column'] + stage_suffixes[1],
-                     extra_metadata['response_column'] + stage_suffixes[1]]
-
-    df_type1 = split_rows_to_columns(df_stage, (extra_metadata['type_column'] +
-                                                stage_suffixes[0]),
-                                     dict(zip(list(mapping_dict.keys()),
-                                          type_suffixes)), merge_columns)
-
-    merge_columns = [extra_metadata['person_enrollment_ID']]
-    for ts in type_suffixes:
-        col = extra_metadata['response_column'] + stage_suffixes[0] + ts
-        if col in list(df_type1.columns.values):
-            merge_columns.append(col)
-    df_wide = split_rows_to_columns(df_type1, (extra_metadata['type_column'] +
-                                    stage_suffixes[1]),
-                                    dict(zip(list(mapping_dict.keys()),
-                                             type_suffixes)), merge_columns)
+
+    # split the rows by collection stage and disability type in one pass
+    stage_suffixes = ENTRY_EXIT_SUFFIX
+    df_wide = read_entry_exit_table(metadata, county=county,
+                                    file_spec=file_spec, data_dir=data_dir,
+                                    paths=paths, suffixes=stage_suffixes,
+                                    n_jobs=n_jobs,
+                                    category_columns=[
+                                        extra_metadata['type_column']],
+                                    category_suffixes=[
+                                        dict(zip(list(mapping_dict.keys()),
+                                                 type_suffixes))])
 
     response_cols = []
     new_cols = []
@@ -662,12 +913,15 @@ def get_disabilities(county=None, file_spec=None,  data_dir=None, paths=None,
 
     return df_wide
 
-get_disabilities.__doc__ = get_disabilities.__doc__ % (file_path_boilerplate,
-                                                       metdata_boilerplate)
+get_disabilities.__doc__ = get_disabilities.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('employment_education',
+               'EmploymentEducation.csv')
 def get_employment_education(county=None, file_spec=None, data_dir=None, paths=None,
-                             metadata_file=METADATA_FILES['employment_education']):
+                             metadata_file=METADATA_FILES['employment_education'],
+                             n_jobs=1):
     """
     Read in the raw EmploymentEducation tables.
 
@@ -677,6 +931,8 @@ def get_employment_education(county=None, file_spec=None, data_dir=None, paths=N
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing employment and education at entry & exit
@@ -687,16 +943,17 @@ def get_employment_education(county=None, file_spec=None, data_dir=None, paths=N
 
     df_wide = read_entry_exit_table(metadata_file, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths)
+                                    paths=paths, n_jobs=n_jobs)
 
     return df_wide
 
 get_employment_education.__doc__ = get_employment_education.__doc__ % (
-    file_path_boilerplate, metdata_boilerplate)
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('health_dv', 'HealthAndDV.csv')
 def get_health_dv(county=None, file_spec=None, data_dir=None, paths=None,
-                  metadata_file=METADATA_FILES['health_dv']):
+                  metadata_file=METADATA_FILES['health_dv'], n_jobs=1):
     """
     Read in the raw HealthAndDV tables.
 
@@ -706,6 +963,8 @@ def get_health_dv(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing employment and education at entry & exit
@@ -716,16 +975,17 @@ def get_health_dv(county=None, file_spec=None, data_dir=None, paths=None,
 
     df_wide = read_entry_exit_table(metadata_file, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths)
+                                    paths=paths, n_jobs=n_jobs)
 
     return df_wide
 
-get_health_dv.__doc__ = get_health_dv.__doc__ % (file_path_boilerplate,
-                                                 metdata_boilerplate)
+get_health_dv.__doc__ = get_health_dv.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('income', 'IncomeBenefits.csv')
 def get_income(county=None, file_spec=None, data_dir=None, paths=None,
-               metadata_file=METADATA_FILES['income']):
+               metadata_file=METADATA_FILES['income'], n_jobs=1):
     """
     Read in the raw IncomeBenefits tables.
 
@@ -735,6 +995,8 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing income at entry & exit of a person per
@@ -754,7 +1016,8 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
     suffixes = ENTRY_EXIT_SUFFIX
     df_wide = read_entry_exit_table(metadata, county=county,
                                     file_spec=file_spec, data_dir=data_dir,
-                                    paths=paths, suffixes=suffixes)
+                                    paths=paths, suffixes=suffixes,
+                                    n_jobs=n_jobs)
 
     maximize_cols = []
     for sf in suffixes:
@@ -770,30 +1033,30 @@ def get_income(county=None, file_spec=None, data_dir=None, paths=None,
                           ' is not in maximize_cols so only the first value' +
                           ' per projectID per entry or exit will be kept')
 
-    gb = df_wide.groupby(person_enrollment_ID)
-    for index, tpl in enumerate(gb):
-        name, group = tpl
-        if len(group) == 1:
-            continue
-
-        update_dict = {}
-        for col in maximize_cols:
-            if col in group.columns:
-                max_val = group[col].max()
-                row_index = df_wide[df_wide[person_enrollment_ID] == name].index.tolist()
-                df_wide.set_value(row_index[0], col, max_val)
+    max_cols = [col for col in maximize_cols if col in df_wide.columns]
+    has_id = df_wide[person_enrollment_ID].notnull()
+    max_vals = df_wide.loc[has_id].groupby(person_enrollment_ID)[max_cols].max()
 
+    # Keep the first row per enrollment, with the maximum over all of the
+    # enrollment's rows in the maximize_cols
     df_wide = df_wide.drop_duplicates([person_enrollment_ID])
+    has_id = df_wide[person_enrollment_ID].notnull()
+    for col in max_cols:
+        df_wide[col] = df_wide[col].where(
+            ~has_id, df_wide[person_enrollment_ID].map(max_vals[col]))
+
     return df_wide
 
-get_income.__doc__ = get_income.__doc__ % (file_path_boilerplate,
-                                           metdata_boilerplate)
+get_income.__doc__ = get_income.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
 
 
+@_cached_table('project', 'Project.csv')
 def get_project(county=None, file_spec=None, data_dir=None, paths=None,
                 metadata_file=METADATA_FILES['project'],
                 project_type_file=op.join(DATA_PATH, 'metadata',
-                                          'project_type.json')):
+                                          'project_type.json'),
+                n_jobs=1):
     """
     Read in the raw Exit tables and map to project info.
 
@@ -803,6 +1066,8 @@ def get_project(county=None, file_spec=None, data_dir=None, paths=None,
 
     %s
 
+    %s
+
     Returns
     ----------
     dataframe with rows representing exit record of a person per enrollment
@@ -814,7 +1079,7 @@ def get_project(county=None, file_spec=None, data_dir=None, paths=None,
     project_type_column = metadata.pop('project_type_column')
     projectID = metadata.pop('program_ID')
     df = read_table(file_spec, county=county, data_dir=data_dir, paths=paths,
-                    **metadata)
+                    n_jobs=n_jobs, **metadata)
 
     # get project_type dict
     mapping_dict = get_metadata_dict(project_type_file)
@@ -837,13 +1102,43 @@ def get_project(county=None, file_spec=None, data_dir=None, paths=None,
 
     return df_merge
 
-get_project.__doc__ = get_project.__doc__ % (file_path_boilerplate,
-                                             metdata_boilerplate)
+get_project.__doc__ = get_project.__doc__ % (
+    file_path_boilerplate, metdata_boilerplate, cache_boilerplate)
+
 
 
+def _call(func, **kwargs):
+    """Call func(**kwargs), for running different loaders in one pool."""
+    return func(**kwargs)
+
+
+def _load_tables(loaders, n_jobs=1):
+    """
+    Run the functions that load & clean each table.
+
+    Parameters
+    ----------
+    loaders : dict
+        maps table names to (function, keyword arguments) tuples
+
+    n_jobs : int
+        number of tables to load concurrently, each in its own process.
+        Values < 1 use all the cores (see puget.utils.n_workers)
+
+    Returns
+    ----------
+    dict mapping table names to dataframes
+    """
+    # Each table is read with a single worker inside its own process
+    tables = pu.run_in_pool(_call, [((func,), kwargs)
+                                    for func, kwargs in loaders.values()],
+                            n_jobs=n_jobs)
+    return dict(zip(loaders.keys(), tables))
+
 
 def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
-                 paths=None, files=None, groups=True, name_exclusion=False):
+                 paths=None, files=None, groups=True, name_exclusion=False,
+                 cache_dir=None, n_jobs=1):
     """ Run all functions that clean up raw tables separately, and merge them
         all into the enrollment table, where each row represents the project
         enrollment of an individual.
@@ -870,6 +1165,16 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         paths : list
             list of directories inside data_dir to look for csv files in
 
+        cache_dir : string
+            full path to a directory to cache the cleaned tables in (see
+            puget.cache). Default is None (no caching)
+
+        n_jobs : int
+            number of tables to load concurrently, each in its own process.
+            Default is 1 (load the tables one after another). Values < 1 use
+            all the cores, and there are never more processes than cores or
+            tables
+
         Returns
         ----------
         dataframe with rows representing the record of a person per
@@ -878,12 +1183,24 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
     if not isinstance(files, dict):
         files = {}
 
+    # The tables are independent of each other until they are merged, so
+    # load them all (possibly in parallel) before doing any merging
+    loaders = {'enrollment': (get_enrollment, {'groups': groups}),
+               'exit': (get_exit, {}),
+               'client': (get_client, {'name_exclusion': name_exclusion}),
+               'disabilities': (get_disabilities, {}),
+               'employment_education': (get_employment_education, {}),
+               'health_dv': (get_health_dv, {}),
+               'income': (get_income, {}),
+               'project': (get_project, {})}
+    for table, (func, kwargs) in loaders.items():
+        kwargs.update(county=county, file_spec=files.get(table, None),
+                      metadata_file=meta_files.get(table, None),
+                      data_dir=data_dir, paths=paths, cache_dir=cache_dir)
+    tables = _load_tables(loaders, n_jobs=n_jobs)
+
     # Get enrollment data
-    enroll = get_enrollment(county=county,
-                            file_spec=files.get('enrollment', None),
-                            metadata_file=meta_files.get('enrollment', None),
-                            groups=groups, data_dir=data_dir,
-                            paths=paths)
+    enroll = tables['enrollment']
     print('enroll n_rows:', len(enroll))
     enrollment_metadata = get_metadata_dict(meta_files.get('enrollment',
                                             METADATA_FILES['enrollment']))
@@ -893,9 +1210,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
     # print(enroll)
 
     # Merge exit in
-    exit_table = get_exit(county=county, file_spec=files.get('exit', None),
-                          metadata_file=meta_files.get('exit', None),
-                          data_dir=data_dir, paths=paths)
+    exit_table = tables['exit']
     print('exit n_rows:', len(exit_table))
     exit_metadata = get_metadata_dict(meta_files.get('exit',
                                       METADATA_FILES['exit']))
@@ -910,66 +1225,28 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(exit_ppid_column, axis=1)
 
     # Merge client in
-    client = get_client(county=county, file_spec=files.get('client', None),
-                        metadata_file=meta_files.get('client', None),
-                        data_dir=data_dir, paths=paths,
-                        name_exclusion=name_exclusion)
+    client = tables['client']
 
     print('client n_rows:', len(client))
     client_metadata = get_metadata_dict(meta_files.get('client',
                                         METADATA_FILES['client']))
     client_pid_column = client_metadata['person_ID']
     dob_column = client_metadata['dob_column']
-    n_bad_dob = 0
     # set any DOBs to NaNs if they are in the future relative to the earliest
     # enrollment. Also set to NaN if the DOB is too early (pre 1900)
-    gb = client.groupby(client_pid_column)
-    for pid, group in gb:
-        enroll_dates = enroll_merge[enroll_merge[enrollment_pid_column] ==
-                                    pid][enrollment_metadata['entry_date']]
-        earliest_enrollment = enroll_dates.min()
-
-        bad_dob = np.logical_or(group[dob_column] > earliest_enrollment,
-                                group[dob_column] < pd.to_datetime(
-                                    '1900/1/1', format='%Y/%m/%d'))
-        n_bad_dob += np.sum(bad_dob)
-        n_entries = group.shape[0]
-
-        if np.sum(bad_dob) > 0:
-            if n_entries == 1:
-                client.loc[group.index, dob_column] = pd.NaT
-            else:
-                if max(group[dob_column]) == min(group[dob_column]):
-                    client.loc[group.index, dob_column] = pd.NaT
-                else:
-                    client.loc[group.index[np.where(bad_dob)],
-                               dob_column] = pd.NaT
-
-    gb = client.groupby(client_pid_column)
-    for pid, group in gb:
-        n_entries = group.shape[0]
-        if n_entries > 1:
-            # for differences in DOB, if the difference is less than
-            # a year then take the midpoint, otherwise set to NaN
-            if len(np.unique(group[dob_column])) > 1:
-                is_valid = ~pd.isnull(group[dob_column])
-                n_valid = np.sum(is_valid)
-                if n_valid == 1:
-                    client.loc[group.index, dob_column] = \
-                        group[dob_column][is_valid].values[0]
-                elif n_valid > 1:
-                    t_diff = (np.max(group[dob_column]) -
-                              np.min(group[dob_column]))
-                    if t_diff < datetime.timedelta(365):
-                        t_diff_sec = t_diff.seconds + 86400 * t_diff.days
-                        new_date = (np.min(group[dob_column]) +
-                                    datetime.timedelta(
-                                        seconds=t_diff_sec / 2.)).date()
-                        client.loc[group.index, dob_column] = \
-                            pd.datetime(new_date.year, new_date.month,
-                                        new_date.day)
-                    else:
-                        client.loc[group.index, dob_column] = pd.NaT
+    earliest_enrollment = enroll_merge.groupby(enrollment_pid_column)[
+        enrollment_metadata['entry_date']].min()
+    client_earliest = client[client_pid_column].map(earliest_enrollment)
+    bad_dob = np.logical_or(client[dob_column] > client_earliest,
+                            client[dob_column] < pd.to_datetime(
+                                '1900/1/1', format='%Y/%m/%d'))
+    bad_dob &= client[client_pid_column].notnull()
+    n_bad_dob = np.sum(bad_dob)
+    client.loc[bad_dob, dob_column] = pd.NaT
+
+    # for differences in DOB, if the difference is less than
+    # a year then take the midpoint, otherwise set to NaN
+    _resolve_conflicts(client, client_pid_column, [dob_column], 'time')
 
     # now drop duplicates
     client = client.drop_duplicates(client_metadata['duplicate_check_columns'],
@@ -986,11 +1263,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(client_pid_column, axis=1)
 
     # Merge disabilities in
-    disabilities = get_disabilities(county=county,
-                                    file_spec=files.get('disabilities', None),
-                                    metadata_file=meta_files.get('disabilities', None),
-                                    data_dir=data_dir,
-                                    paths=paths)
+    disabilities = tables['disabilities']
     print('disabilities n_rows:', len(disabilities))
     disabilities_metadata = get_metadata_dict(meta_files.get('disabilities',
                                               METADATA_FILES['disabilities']))
@@ -1004,10 +1277,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(disabilities_ppid_column, axis=1)
 
     # Merge employment_education in
-    emp_edu = get_employment_education(county=county,
-                                       file_spec=files.get('employment_education', None),
-                                       metadata_file=meta_files.get('employment_education', None),
-                                       data_dir=data_dir, paths=paths)
+    emp_edu = tables['employment_education']
     print('emp_edu n_rows:', len(emp_edu))
     emp_edu_metadata = get_metadata_dict(meta_files.get('employment_education',
                                          METADATA_FILES['employment_education']))
@@ -1021,10 +1291,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(emp_edu_ppid_column, axis=1)
 
     # Merge health in
-    health_dv = get_health_dv(county=county,
-                              file_spec=files.get('health_dv', None),
-                              metadata_file=meta_files.get('health_dv', None),
-                              data_dir=data_dir, paths=paths)
+    health_dv = tables['health_dv']
     print('health_dv n_rows:', len(health_dv))
     health_dv_metadata = get_metadata_dict(meta_files.get('health_dv',
                                            METADATA_FILES['health_dv']))
@@ -1038,9 +1305,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(health_dv_ppid_column, axis=1)
 
     # Merge income in
-    income = get_income(county=county, file_spec=files.get('income', None),
-                        metadata_file=meta_files.get('income', None),
-                        data_dir=data_dir, paths=paths)
+    income = tables['income']
     print('income n_rows:', len(income))
     income_metadata = get_metadata_dict(meta_files.get('income',
                                         METADATA_FILES['income']))
@@ -1054,9 +1319,7 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
         enroll_merge = enroll_merge.drop(income_ppid_column, axis=1)
 
     # Merge project in
-    project = get_project(county=county, file_spec=files.get('project', None),
-                          metadata_file=meta_files.get('project', None),
-                          data_dir=data_dir, paths=paths)
+    project = tables['project']
     print('project n_rows:', len(project))
     project_metadata = get_metadata_dict(meta_files.get('project',
                                          METADATA_FILES['project']))
@@ -1073,31 +1336,117 @@ def merge_tables(county=None, meta_files=METADATA_FILES, data_dir=None,
     return enroll_merge
 
 
-def _has_digit(my_str):
-    return any(char.isdigit() for char in my_str)
+def _merge_county(county, county_kwargs, county_column, output_dir):
+    """
+    Run merge_tables for one county and tag the rows with the county name.
+
+    If output_dir is given, the table is written to
+    output_dir/*county_column*=*county*/enrollment.parquet and the file name
+    is returned instead of the table. The file has no county column: the
+    county is only recorded in the directory name, as usual for partitioned
+    Parquet (pd.read_parquet(output_dir) adds it back).
+    """
+    df = merge_tables(county=county, **county_kwargs)
+    if output_dir is None:
+        df[county_column] = county
+        return df
+    county_dir = op.join(output_dir, '%s=%s' % (county_column, county))
+    os.makedirs(county_dir, exist_ok=True)
+    fname = op.join(county_dir, 'enrollment.parquet')
+    df.to_parquet(fname)
+    return fname
+
+
+def merge_counties(counties=None, county_column='county', output_dir=None,
+                   n_jobs=1, **kwargs):
+    """
+    Run merge_tables for several counties, each in its own process, and
+    combine the results.
 
-def _is_in_exclusion(my_str, exclusion_list):
-    for item in exclusion_list:
-        if item in my_str:
-            return True
-    return False
+    Parameters
+    ----------
+    counties : list or dict
+        names of the counties to process. If a dict, values are dicts of
+        keyword arguments for merge_tables that only apply to that county
+        (e.g. data_dir & paths). Default is None, which uses all the counties
+        in COUNTY_FOLDERS
+
+    county_column : string
+        name of the column to put the county name in. Default is 'county'
+
+    output_dir : string
+        full path to a directory to write the table of each county to, as
+        output_dir/*county_column*=*county*/enrollment.parquet (this
+        requires pyarrow), which can be read back with
+        pd.read_parquet(output_dir). Default is None, which returns the
+        combined table instead
+
+    n_jobs : int
+        number of counties to process concurrently, each in its own process.
+        Default is 1 (one county after another). Values < 1 use all the
+        cores, and there are never more processes than cores or counties.
+        Peak memory is about n_jobs times that of the largest
+        county (plus the combined table if output_dir is None)
+
+    kwargs :
+        any other keyword arguments are passed to merge_tables for all
+        counties
 
-def _name_exclude(row,
+    Returns
+    ----------
+    dataframe with the rows of all counties (with a new index), or if
+    output_dir is given, a dict mapping each county to its output file
+    """
+    if counties is None:
+        counties = list(COUNTY_FOLDERS.keys())
+    if not isinstance(counties, dict):
+        counties = {county: {} for county in counties}
+    if 'county' in kwargs:
+        raise ValueError('Use counties rather than county to select counties')
+
+    jobs = {}
+    for county, county_kwargs in counties.items():
+        merge_kwargs = dict(kwargs)
+        merge_kwargs.update(county_kwargs)
+        jobs[county] = (county, merge_kwargs, county_column, output_dir)
+
+    results = pu.run_in_pool(_merge_county, [(args, {})
+                                             for args in jobs.values()],
+                             n_jobs=n_jobs)
+    results = dict(zip(jobs.keys(), results))
+
+    if output_dir is not None:
+        return results
+    return pd.concat(list(results.values()), ignore_index=True, sort=False)
+
+
+def _name_exclude(df,
                   name_cols,
                   exclusion_list=NAME_EXCLUSION):
     """
-    Criteria for name exclusion. Returns True for keepers.
+    Criteria for name exclusion. Returns a boolean array that is True for
+    keepers: rows where every name column is a string that (lower-cased,
+    ignoring '.') contains none of exclusion_list, is not a single character
+    and has no digits.
     """
+    # One regex for both the excluded words and digits
+    exclude_re = re.compile('|'.join([re.escape(item)
+                                      for item in exclusion_list] + [r'\d']))
+    keep = np.ones(df.shape[0], dtype=bool)
     for c in name_cols:
-        if pd.isnull(row[c]):
-            return False
-        if isinstance(row[c], (float, int)):
-            return False
-        name = row[c].lower().replace('.', '')
-        if _is_in_exclusion(name, exclusion_list):
-            return False
-        if len(name) == 1:
-            return False
-        if _has_digit(name):
-            return False
-    return True
\ No newline at end of file
+        name = df[c]
+        if name.dtype == 'category':
+            name = name.astype(object)
+        if not pd.api.types.is_string_dtype(name):
+            # numeric (or missing) names
+            keep[:] = False
+            break
+        # non-strings (missing or numeric names) become NaN here
+        name = name.str.lower().str.replace('.', '', regex=False)
+        is_name = name.notnull().values
+        name = name[is_name].astype(str)
+        is_keeper = np.zeros(df.shape[0], dtype=bool)
+        is_keeper[is_name] = ~(name.str.contains(exclude_re).values |
+                               (name.str.len() == 1).values)
+        keep &= is_keeper
+    return keep
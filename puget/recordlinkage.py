@@ -2,40 +2,484 @@
 
 """
 import numpy as np
-import recordlinkage as rl
-import networkx
+import pandas as pd
+import recordlinkage.algorithms.string as rls
+import jellyfish
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+import puget.utils as pu
 
 
 MATCH_THRESHOLD = 0.5
 STRING_THRESHOLD = 0.85
 
-def block_and_match(df, block_variable, comparison_dict, match_threshold=MATCH_THRESHOLD,
-                    string_method="jarowinkler", string_threshold=STRING_THRESHOLD):
+STRING_METHODS = {'jaro': rls.jaro_similarity,
+                  'jarowinkler': rls.jarowinkler_similarity,
+                  'jaro_winkler': rls.jarowinkler_similarity,
+                  'jw': rls.jarowinkler_similarity,
+                  'levenshtein': rls.levenshtein_similarity,
+                  'dameraulevenshtein': rls.damerau_levenshtein_similarity,
+                  'damerau_levenshtein': rls.damerau_levenshtein_similarity,
+                  'dl': rls.damerau_levenshtein_similarity,
+                  'q_gram': rls.qgram_similarity,
+                  'qgram': rls.qgram_similarity,
+                  'cosine': rls.cosine_similarity,
+                  'smith_waterman': rls.smith_waterman_similarity,
+                  'smithwaterman': rls.smith_waterman_similarity,
+                  'sw': rls.smith_waterman_similarity,
+                  'longest_common_substring':
+                      rls.longest_common_substring_similarity,
+                  'lcs': rls.longest_common_substring_similarity}
+
+# Dates in the same year with these months swapped (and the same day) are
+# half a match (the recordlinkage default)
+SWAP_MONTHS = [(6, 7), (7, 6), (9, 10), (10, 9)]
+
+
+# Name variables of the prelinked data
+NAME_COLUMNS = ["lname", "fname"]
+
+# Names containing any of these are placeholders, not actual names
+NAME_PLACEHOLDERS = ["CONSENT", "REFUSED", "ANONYMOUS", "CLIENT", "REFSUED",
+                     "NONAME", "UNKNOWN"]
+
+PHONETIC_CODES = {'soundex': jellyfish.soundex,
+                  'nysiis': jellyfish.nysiis,
+                  'metaphone': jellyfish.metaphone}
+
+# Options of a link_list pass that select how records are blocked
+BLOCKING_OPTIONS = ['blocking', 'window', 'max_block_size',
+                    'sub_block_variable']
+
+
+def normalize_names(df, name_columns=NAME_COLUMNS, codes=PHONETIC_CODES,
+                    placeholders=NAME_PLACEHOLDERS):
     """
-    Use recordlinkage to block on one variable and compare on others
+    Add cleaned names and phonetic codes of names, to block on.
+
+    Names are upper-cased and stripped of anything that is not a letter, and
+    placeholders (e.g. "REFUSED") and empty names are set to missing. Each
+    distinct name is only cleaned and coded once, and the new columns are
+    categorical, so they are compact and cheap to block on in every pass of
+    link_records.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records
+
+    name_columns : list
+        The name variables to normalize
+
+    codes : list
+        The phonetic codes to compute (keys of PHONETIC_CODES). Default is
+        all of them
+
+    placeholders : list
+        Names that contain any of these are set to missing
+
+    Returns
+    -------
+    df with, for each name variable (e.g. lname), a lname_clean column and a
+    column for each phonetic code (e.g. lname_soundex)
+    """
+    placeholder_re = "|".join(placeholders)
+    for column in name_columns:
+        name_codes, names = pd.factorize(df[column])
+        clean = pd.Series(names.astype(str)).str.upper()
+        clean = clean.str.replace("[^A-Z]", "", regex=True)
+        is_name = (clean.str.len() > 0)
+        if placeholder_re:
+            is_name &= ~clean.str.contains(placeholder_re)
+        clean = clean.where(is_name)
+        new_columns = {column + "_clean": clean}
+        for code in codes:
+            new_columns[column + "_" + code] = clean.map(PHONETIC_CODES[code],
+                                                         na_action="ignore")
+        for new_column, values in new_columns.items():
+            # Missing names (code -1) pick up the NaN appended at the end:
+            values = np.append(values.values, np.nan)
+            df[new_column] = pd.Categorical(values[name_codes])
+    return df
+
+
+def _key_codes(df, columns):
+    """
+    Number the (compound) key of each record in sorted key order.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records
+
+    columns : string or list
+        The variable(s) that make up the key
+
+    Returns
+    -------
+    int array with the rank of the key of each record among all keys (-1 if
+    any part of the key is missing)
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    codes = np.zeros(df.shape[0], dtype=np.int64)
+    missing = np.zeros(df.shape[0], dtype=bool)
+    for column in columns:
+        column_codes, uniques = pd.factorize(df[column], sort=True)
+        missing |= column_codes < 0
+        codes = codes * (uniques.shape[0] + 1) + column_codes
+        # Keep the codes small:
+        codes = pd.factorize(codes, sort=True)[0]
+    codes[missing] = -1
+    # Renumber, so the non-missing keys are 0, ..., n_keys - 1:
+    present = codes >= 0
+    codes[present] = pd.factorize(codes[present], sort=True)[0]
+    return codes
 
+
+def _window_pairs(values, window):
+    """
+    Find all pairs of records whose values are at most window apart (see
+    puget.utils.window_pairs). Records with negative values are never
+    paired.
+
+    Returns
+    -------
+    Two arrays with the positions of the first and second record of each
+    pair. The first position is always the larger one.
+    """
+    # Without chunk_size, all the pairs come in one go
+    first, second = next(pu.window_pairs(values, window, valid=values >= 0))
+    return np.maximum(first, second), np.minimum(first, second)
+
+
+def block_pairs(df, block_variable, blocking="block", window=3,
+                max_block_size=None, sub_block_variable=None):
+    """
+    Find candidate pairs of records to compare.
+
+    Parameters
+    ----------
+    df : DataFrame
+        The records
+
+    block_variable : string or list
+        The variable(s) to block on. A list makes a compound key (e.g.
+        ['lname_initial', 'dob_year']). Records with a missing key are not
+        paired
+
+    blocking : string
+        "block" pairs records with the same key. "sortedneighbourhood" sorts
+        the keys and pairs records whose keys are at most (window - 1) / 2
+        keys apart, so that keys with small differences (e.g. typos at the
+        end of names) are still compared
+
+    window : int
+        Size of the sorted neighbourhood (an odd number). Default is 3
+
+    max_block_size : int
+        If provided, records in blocks with more records than this are only
+        paired within sub-blocks, keyed on both block_variable and
+        sub_block_variable (records with a missing sub-block key are not
+        paired). Sub-blocks that are still too large are sorted (on
+        sub_block_variable) and each record is only paired with the
+        (window - 1) / 2 records on either side of it. This keeps the number
+        of pairs from large blocks (e.g. common surnames) linear in their
+        size
+
+    sub_block_variable : string or list
+        The variable(s) to split large blocks on
+
+    Returns
+    -------
+    MultiIndex with the pairs of record labels. The first record of each
+    pair comes later in df.
+    """
+    if blocking not in ["block", "sortedneighbourhood"]:
+        raise ValueError("blocking must be 'block' or 'sortedneighbourhood'")
+    if window < 1 or window % 2 != 1:
+        raise ValueError('window must be a positive odd number')
+    half_window = (window - 1) // 2
+
+    codes = _key_codes(df, block_variable)
+    firsts = []
+    seconds = []
+    if max_block_size is not None:
+        is_large = np.zeros(df.shape[0], dtype=bool)
+        present = codes >= 0
+        block_sizes = np.bincount(codes[present])
+        is_large[present] = block_sizes[codes[present]] > max_block_size
+        codes[is_large] = -1
+
+        if np.any(is_large):
+            if isinstance(block_variable, str):
+                block_variable = [block_variable]
+            if sub_block_variable is None:
+                sub_block_variable = []
+            elif isinstance(sub_block_variable, str):
+                sub_block_variable = [sub_block_variable]
+            sub_codes = _key_codes(df, list(block_variable) +
+                                   list(sub_block_variable))
+            sub_codes[~is_large] = -1
+            present = sub_codes >= 0
+            sub_block_sizes = np.bincount(sub_codes[present])
+            is_still_large = np.zeros(df.shape[0], dtype=bool)
+            is_still_large[present] = \
+                sub_block_sizes[sub_codes[present]] > max_block_size
+            # Sub-blocks that are small enough are used as blocks:
+            small_codes = sub_codes.copy()
+            small_codes[is_still_large] = -1
+            first, second = _window_pairs(small_codes, 0)
+            firsts.append(first)
+            seconds.append(second)
+            # The others are ranked record by record (in sub-block order),
+            # with a gap between sub-blocks, so records are only paired with
+            # the records next to them in the same sub-block:
+            still_large = np.flatnonzero(is_still_large)
+            order = still_large[np.argsort(sub_codes[still_large],
+                                           kind='mergesort')]
+            ranks = np.full(df.shape[0], -1, dtype=np.int64)
+            ranks[order] = (np.arange(order.shape[0]) +
+                            sub_codes[order] * (df.shape[0] + window))
+            first, second = _window_pairs(ranks, half_window)
+            firsts.append(first)
+            seconds.append(second)
+
+    if blocking == "block":
+        first, second = _window_pairs(codes, 0)
+    else:
+        first, second = _window_pairs(codes, half_window)
+    firsts.append(first)
+    seconds.append(second)
+    first = np.concatenate(firsts)
+    second = np.concatenate(seconds)
+    return pd.MultiIndex.from_arrays([df.index[first], df.index[second]])
+
+
+def compare_strings(left_codes, right_codes, values, method="jarowinkler",
+                    threshold=STRING_THRESHOLD):
     """
+    Compare pairs of strings.
+
+    Names are repeated many times across records, so each distinct pair of
+    strings is only compared once, and the result is broadcast to all the
+    record pairs that have it.
+
+    Parameters
+    ----------
+    left_codes, right_codes : array
+        For each pair of records, the index into values of their strings
+        (-1 for missing strings)
+
+    values : array
+        The distinct strings
+
+    method : string
+        A string similarity method of recordlinkage.Compare.string
 
-    indexer = rl.BlockIndex(on=block_variable)
-    pairs = indexer.index(df)
-    compare = rl.Compare()
+    threshold : float or None
+        Similarities at least this high are 1, others are 0. If None, the
+        similarities are returned as they are
+
+    Returns
+    -------
+    float array with the similarity of each pair (NaN if a string is
+    missing)
+    """
+    if method not in STRING_METHODS:
+        raise ValueError("The algorithm '{}' is not known.".format(method))
+    c = np.full(left_codes.shape[0], np.nan)
+    present = (left_codes >= 0) & (right_codes >= 0)
+    keys = (left_codes[present].astype(np.int64) * values.shape[0] +
+            right_codes[present])
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    if unique_keys.shape[0] == 0:
+        return c
+    sim = STRING_METHODS[method](
+        pd.Series(values[unique_keys // values.shape[0]]),
+        pd.Series(values[unique_keys % values.shape[0]])).values
+    sim = sim.astype(float)
+    if threshold is not None:
+        sim = np.where(np.isnan(sim), np.nan,
+                       (sim >= threshold).astype(float))
+    c[present] = sim[inverse]
+    return c
+
+
+def compare_dates(left, right):
+    """
+    Compare pairs of dates, as recordlinkage.Compare.date does by default:
+    equal dates are 1, dates in the same year with day and month swapped, or
+    with months in SWAP_MONTHS swapped, are 0.5 and other dates are 0.
+
+    Parameters
+    ----------
+    left, right : DatetimeIndex or datetime64 array
+        The dates of the first and second record of each pair
+
+    Returns
+    -------
+    float array with the similarity of each pair (NaN if a date is missing)
+    """
+    left = pd.DatetimeIndex(left)
+    right = pd.DatetimeIndex(right)
+    same_year = np.asarray(left.year == right.year)
+    c = np.asarray(left == right).astype(float)
+    swapped = (same_year & np.asarray(left.month == right.day) &
+               np.asarray(left.day == right.month))
+    for month1, month2 in SWAP_MONTHS:
+        swapped |= (same_year & np.asarray(left.month == month1) &
+                    np.asarray(right.month == month2) &
+                    np.asarray(left.day == right.day))
+    c[swapped & (c != 1)] = 0.5
+    c[np.asarray(left.isnull() | right.isnull())] = np.nan
+    return c
+
+
+def _compute_features(df, left, right, comparison_dict,
+                      string_method="jarowinkler",
+                      string_threshold=STRING_THRESHOLD):
+    """
+    Compare pairs of records, given by their positions in df, on several
+    variables.
+
+    Returns
+    -------
+    dict mapping each variable to an array with the comparison of each pair
+    """
+    features = {}
     for k, v in comparison_dict.items():
         if v == "string":
-            compare.string(k, k, method=string_method,
-                           threshold=string_threshold, label=k,
-                           missing_value=np.nan)
+            codes, values = pd.factorize(df[k])
+            features[k] = compare_strings(codes[left], codes[right],
+                                          np.asarray(values, dtype=object),
+                                          method=string_method,
+                                          threshold=string_threshold)
         if v == "date":
-            compare.date(k, k, label=k, missing_value=np.nan)
+            dates = df[k].values
+            features[k] = compare_dates(dates[left], dates[right])
+    return features
+
+
+# The records, in each worker process of _run_in_chunks
+_worker_df = None
+
+
+def _set_worker_df(df):
+    global _worker_df
+    _worker_df = df
+
+
+def _call_with_worker_df(func, *args, **kwargs):
+    return func(_worker_df, *args, **kwargs)
+
+
+def _run_in_chunks(func, df, chunk_args, n_jobs=1, **kwargs):
+    """
+    Run func(df, *args, **kwargs) for the args of each chunk.
+
+    With n_jobs != 1 the chunks are run on a pool of processes (see
+    puget.utils.n_workers; each process holds a copy of the records, so
+    there are never more processes than cores). The records are only sent
+    once to each process.
+
+    Returns
+    -------
+    list with the output for each chunk
+    """
+    if pu.n_workers(n_jobs, len(chunk_args)) == 1:
+        return [func(df, *args, **kwargs) for args in chunk_args]
+    return pu.run_in_pool(_call_with_worker_df,
+                          [((func,) + tuple(args), kwargs)
+                           for args in chunk_args],
+                          n_jobs=n_jobs, initializer=_set_worker_df,
+                          initargs=(df,))
 
-    features = compare.compute(pairs, df)
+
+def _chunk_slices(n_pairs, chunk_size=None):
+    """Split range(n_pairs) into slices of at most chunk_size."""
+    if chunk_size is None:
+        chunk_size = max(n_pairs, 1)
+    return [slice(start, start + chunk_size)
+            for start in range(0, n_pairs, chunk_size)]
+
+
+def _match_pairs(df, left, right, comparison_dict, match_threshold,
+                 string_method, string_threshold, matches_only):
+    """Compare one chunk of pairs in block_and_match."""
+    pairs = pd.MultiIndex.from_arrays([df.index[left], df.index[right]])
+    features = pd.DataFrame(_compute_features(df, left, right,
+                                              comparison_dict,
+                                              string_method=string_method,
+                                              string_threshold=string_threshold),
+                            index=pairs, columns=list(comparison_dict))
     features["mean"] = features.mean(axis=1, skipna=True)
     features["match"] = features["mean"] > match_threshold
-
+    if matches_only:
+        features = features[features["match"]]
     return features
 
 
+def block_and_match(df, block_variable, comparison_dict, match_threshold=MATCH_THRESHOLD,
+                    string_method="jarowinkler", string_threshold=STRING_THRESHOLD,
+                    chunk_size=None, n_jobs=1, matches_only=False,
+                    **blocking_options):
+    """
+    Use recordlinkage to block on one variable and compare on others
+
+    The candidate pairs are compared chunk_size pairs at a time (default is
+    all at once), on n_jobs processes (default is 1; values < 1 use all the
+    cores, and no more processes than cores are used however many chunks
+    there are). With matches_only, only the matched pairs of each
+    chunk are kept, so memory does not grow with the number of candidate
+    pairs.
+
+    Any blocking_options (blocking, window, max_block_size,
+    sub_block_variable) are passed to block_pairs.
+    """
+
+    pairs = block_pairs(df, block_variable, **blocking_options)
+    left = df.index.get_indexer(pairs.get_level_values(0))
+    right = df.index.get_indexer(pairs.get_level_values(1))
+    chunk_args = [(left[chunk], right[chunk])
+                  for chunk in _chunk_slices(left.shape[0], chunk_size)]
+    chunks = _run_in_chunks(_match_pairs, df, chunk_args, n_jobs=n_jobs,
+                            comparison_dict=comparison_dict,
+                            match_threshold=match_threshold,
+                            string_method=string_method,
+                            string_threshold=string_threshold,
+                            matches_only=matches_only)
+    if len(chunks) == 0:
+        # No candidate pairs (this still gives the features their columns)
+        return _match_pairs(df, left, right, comparison_dict,
+                            match_threshold, string_method,
+                            string_threshold, matches_only)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks)
+
+
+def _match_links(df, left, right, rules, comparison_dict, match_threshold,
+                 string_method, string_threshold):
+    """
+    Compare one chunk of pairs in link_records. rules has the variables
+    of each pass and the pairs (positions in the chunk) it compares.
+    """
+    features = pd.DataFrame(_compute_features(df, left, right,
+                                              comparison_dict,
+                                              string_method=string_method,
+                                              string_threshold=string_threshold),
+                            columns=list(comparison_dict))
+    is_match = np.zeros(left.shape[0], dtype=bool)
+    for columns, rows in rules:
+        mean = features[columns].iloc[rows].mean(axis=1, skipna=True).values
+        is_match[rows[mean > match_threshold]] = True
+    return is_match
+
+
 def link_records(prelink_ids, link_list, match_threshold=MATCH_THRESHOLD,
-                 string_method="jarowinkler", string_threshold=STRING_THRESHOLD):
+                 string_method="jarowinkler", string_threshold=STRING_THRESHOLD,
+                 name_columns=None, chunk_size=None, n_jobs=1):
     """
     Link records from a dataset, using an iterative approach
 
@@ -58,30 +502,89 @@ def link_records(prelink_ids, link_list, match_threshold=MATCH_THRESHOLD,
                                   "lname": "string",
                                   "dob":"date"}}]
 
+        Passes can also block on the cleaned names and phonetic codes added
+        by normalize_names (e.g. 'lname_soundex'), or use other blocking
+        options (see BLOCKING_OPTIONS and block_pairs).
+
+    name_columns : list
+        If provided, normalize_names is run on these name variables (once)
+        before linking.
+
+    chunk_size : int
+        If provided, candidate pairs are compared this many at a time, and
+        only whether they match is kept. Default is all at once.
+
+    n_jobs : int
+        number of processes to compare the chunks on. Default is 1. Values
+        < 1 use all the cores, and no more processes than cores are used
+        however many chunks there are
+
     """
-    matches = []
+    if name_columns is not None:
+        prelink_ids = normalize_names(prelink_ids, name_columns=name_columns)
+
+    # The same pair of records can be a candidate in several passes, so
+    # collect the candidates of all passes, and compare each pair only once
+    n_records = prelink_ids.shape[0]
+    pass_keys = []
+    comparison_dict = {}
     for link in link_list:
-        features = block_and_match(prelink_ids,
-                                   link['block_variable'],
-                                   link['match_variables'],
-                                   match_threshold=match_threshold,
-                                   string_method=string_method,
-                                   string_threshold=string_threshold)
-        matches.append(features[features["match"]])
-
-    G = networkx.Graph()
-    for match in matches:
-        for ix, row in match.iterrows():
-            G.add_edge(row.name[0], row.name[1])
-
-    prelink_ids["linkage_PID"] = np.nan
-    new_pid = 1
-    for linked in networkx.connected.connected_components(G):
-        prelink_ids.loc[linked, "linkage_PID"] = new_pid
-        new_pid = new_pid + 1
-
-    ix = prelink_ids["linkage_PID"].isnull()
-    prelink_ids.loc[ix, "linkage_PID"] = np.arange(new_pid, new_pid + ix.sum())
-    prelink_ids["linkage_PID"] = prelink_ids["linkage_PID"].astype(int)
-
-    return prelink_ids
\ No newline at end of file
+        pairs = block_pairs(prelink_ids, link['block_variable'],
+                            **{k: link[k] for k in BLOCKING_OPTIONS
+                               if k in link})
+        left = prelink_ids.index.get_indexer(pairs.get_level_values(0))
+        right = prelink_ids.index.get_indexer(pairs.get_level_values(1))
+        # Comparisons are symmetric, so pairs are stored in one orientation:
+        pass_keys.append(np.maximum(left, right).astype(np.int64) *
+                         n_records + np.minimum(left, right))
+        for k, v in link['match_variables'].items():
+            if comparison_dict.setdefault(k, v) != v:
+                raise ValueError('%s is compared both as a %s and a %s' %
+                                 (k, comparison_dict[k], v))
+    unique_keys, inverse = np.unique(np.concatenate(pass_keys),
+                                     return_inverse=True)
+    left = unique_keys // n_records
+    right = unique_keys % n_records
+
+    # Each pass only decides on its own candidate pairs:
+    pass_rows = []
+    start = 0
+    for link, keys in zip(link_list, pass_keys):
+        pass_rows.append(np.unique(inverse[start:start + keys.shape[0]]))
+        start = start + keys.shape[0]
+
+    chunk_args = []
+    for chunk in _chunk_slices(unique_keys.shape[0], chunk_size):
+        rules = []
+        for link, rows in zip(link_list, pass_rows):
+            in_chunk = rows[np.searchsorted(rows, chunk.start):
+                            np.searchsorted(rows, chunk.stop)]
+            rules.append((list(link['match_variables']),
+                          in_chunk - chunk.start))
+        chunk_args.append((left[chunk], right[chunk], rules))
+    is_match = _run_in_chunks(_match_links, prelink_ids, chunk_args,
+                              n_jobs=n_jobs,
+                              comparison_dict=comparison_dict,
+                              match_threshold=match_threshold,
+                              string_method=string_method,
+                              string_threshold=string_threshold)
+    is_match = np.concatenate(is_match + [np.zeros(0, dtype=bool)])
+
+    # Link the records of all matched pairs, as connected components of the
+    # graph of matches
+    match_keys = unique_keys[is_match]
+    G = csr_matrix((np.ones(match_keys.shape[0]),
+                    (match_keys // n_records, match_keys % n_records)),
+                   shape=(n_records, n_records))
+    _, components = connected_components(G, directed=False)
+
+    # Linked records get the first PIDs (in order of their first record),
+    # then records that are not linked to any other
+    sizes = np.bincount(components)
+    _, first = np.unique(components, return_index=True)
+    order = np.lexsort([first, sizes == 1])
+    pids = np.empty(sizes.shape[0], dtype=int)
+    pids[order] = np.arange(1, sizes.shape[0] + 1)
+    prelink_ids["linkage_PID"] = pids[components]
+
+    return prelink_ids
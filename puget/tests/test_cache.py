@@ -0,0 +1,101 @@
+"""Tests for functions in cache.py."""
+import os
+import os.path as op
+import json
+import tempfile
+import time
+import pandas as pd
+import pandas.util.testing as pdt
+import pytest
+
+import puget.cache as pc
+import puget.preprocess as pp
+
+pytest.importorskip('pyarrow')
+
+
+def test_make_key():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'test.csv')
+        with open(fname, 'w') as f:
+            f.write('a,b\n1,2\n')
+        key1 = pc.make_key([fname], {'groups': True})
+        # the same inputs give the same key:
+        assert key1 == pc.make_key([fname], {'groups': True})
+        # different options give a different key:
+        assert key1 != pc.make_key([fname], {'groups': False})
+        # changing the file content gives a different key:
+        with open(fname, 'w') as f:
+            f.write('a,b\n1,3\n')
+        assert key1 != pc.make_key([fname], {'groups': True})
+
+
+def test_save_load_clear_evict():
+    df = pd.DataFrame({'id': [1, 2, 3],
+                       'categ': pd.array([0, pd.NA, 1], dtype='Int8'),
+                       'time': pd.to_datetime(['2001-01-13', None,
+                                               '2003-06-10'])},
+                      index=[0, 2, 5])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        assert pc.load_table(temp_dir, 'test', 'abc') is None
+        pc.save_table(df, temp_dir, 'test', 'abc')
+        pdt.assert_frame_equal(pc.load_table(temp_dir, 'test', 'abc'), df)
+
+        pc.save_table(df, temp_dir, 'other', 'abc')
+        assert pc.clear_cache(temp_dir, 'test') == 1
+        assert pc.load_table(temp_dir, 'test', 'abc') is None
+        assert pc.load_table(temp_dir, 'other', 'abc') is not None
+
+        # the least recently used tables are evicted first
+        for key in ['k1', 'k2', 'k3']:
+            pc.save_table(df, temp_dir, 'test', key)
+            past = time.time() - 100 + len(os.listdir(temp_dir))
+            os.utime(pc.cache_file(temp_dir, 'test', key), (past, past))
+        pc.load_table(temp_dir, 'test', 'k1')
+        size = os.stat(pc.cache_file(temp_dir, 'test', 'k1')).st_size
+        assert pc.evict_cache(temp_dir, 2 * size) == 2
+        assert op.exists(pc.cache_file(temp_dir, 'test', 'k1'))
+        assert not op.exists(pc.cache_file(temp_dir, 'test', 'k2'))
+
+        assert pc.clear_cache(temp_dir) == 2
+        assert os.listdir(temp_dir) == []
+
+
+def test_cached_get_table():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_file = op.join(temp_dir, 'Project.csv')
+        pd.DataFrame({'pid': [3, 4], 'name': ['shelter1', 'rrh2'],
+                      'ProjectType': [1, 13]}).to_csv(csv_file, index=False)
+        meta_file = op.join(temp_dir, 'project.json')
+        with open(meta_file, 'w') as f:
+            json.dump({'name': 'test', 'program_ID': 'pid',
+                       'duplicate_check_columns': ['pid', 'name',
+                                                   'ProjectType'],
+                       'columns_to_drop': [],
+                       'project_type_column': 'ProjectType'}, f)
+        cache_dir = op.join(temp_dir, 'cache')
+
+        df = pp.get_project(file_spec={2011: csv_file},
+                            metadata_file=meta_file)
+        df_cached = pp.get_project(file_spec={2011: csv_file},
+                                   metadata_file=meta_file,
+                                   cache_dir=cache_dir)
+        pdt.assert_frame_equal(df, df_cached)
+        assert len(os.listdir(cache_dir)) == 1
+
+        # The second time around the table comes from the cache:
+        df_cached = pp.get_project(file_spec={2011: csv_file},
+                                   metadata_file=meta_file,
+                                   cache_dir=cache_dir)
+        pdt.assert_frame_equal(df, df_cached)
+        assert len(os.listdir(cache_dir)) == 1
+
+        # Changing the source file invalidates the cached table:
+        pd.DataFrame({'pid': [3, 4], 'name': ['shelter1', 'rrh2'],
+                      'ProjectType': [1, 2]}).to_csv(csv_file, index=False)
+        df_cached = pp.get_project(file_spec={2011: csv_file},
+                                   metadata_file=meta_file,
+                                   cache_dir=cache_dir)
+        assert df_cached['ProjectType'].tolist() == ['Emergency Shelter',
+                                                     'Transitional Housing']
+        assert len(os.listdir(cache_dir)) == 2
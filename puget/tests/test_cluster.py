@@ -1,6 +1,10 @@
 
+import os.path as op
+import tempfile
+
 import numpy as np
 import numpy.testing as npt
+import pytest
 
 import pandas as pd
 import pandas.util.testing as pdt
@@ -8,6 +12,25 @@ import pandas.util.testing as pdt
 import puget.cluster as cluster
 
 
+def test_map_individuals():
+    df = pd.DataFrame({'individual_var': [1, 200, 3, 200, 1]})
+    codes, mapping = cluster.map_individuals(df, 'individual_var')
+    npt.assert_equal(codes, [0, 1, 2, 1, 0])
+    npt.assert_equal(list(mapping), [1, 200, 3])
+
+    # A mapping can be given as an Index or a dict:
+    mapping = cluster.make_mapping(np.array([3, 200, 1]))
+    codes, _ = cluster.map_individuals(df, 'individual_var', mapping)
+    npt.assert_equal(codes, [2, 1, 0, 1, 2])
+    codes, _ = cluster.map_individuals(df, 'individual_var',
+                                       {3: 0, 200: 1, 1: 2})
+    npt.assert_equal(codes, [2, 1, 0, 1, 2])
+
+    with pytest.raises(ValueError):
+        cluster.map_individuals(df, 'individual_var',
+                                cluster.make_mapping(np.array([3, 200])))
+
+
 def test_cluster_by_groups():
     # In the first case, all individuals are linked through a chain of
     # co-occurrences:
@@ -69,6 +92,35 @@ def test_cluster_by_groups():
                             true_df2_out.sort_index(axis=1))
 
 
+def test_cluster_min_weight():
+    # 200 and 3 share two groups, all other pairs share at most one:
+    df = pd.DataFrame({'individual_var': [1, 200, 3, 100, 1, 200, 3, 100],
+                       'group_var': [1, 1, 2, 2, 1, 2, 1, 2],
+                       'time_var1': pd.to_datetime(['2001-01-13',
+                                                    '2001-01-13',
+                                                    '2003-06-10',
+                                                    '2003-06-10',
+                                                    '2001-01-13',
+                                                    '2001-01-13',
+                                                    '2003-06-10',
+                                                    '2003-06-10'])})
+    for sparse in [True, False]:
+        df_out = cluster.cluster(df, 'individual_var', group_var='group_var',
+                                 sparse=sparse, min_weight=2)
+        npt.assert_equal(df_out['cluster'].values, [1, 2, 2, 3, 1, 2, 2, 3])
+
+        # Co-occurring in time as well as in a group makes a link strong
+        # enough, unless time co-occurrence doesn't count:
+        df_out = cluster.cluster(df, 'individual_var', group_var='group_var',
+                                 time_var=['time_var1'], sparse=sparse,
+                                 min_weight=2)
+        npt.assert_equal(df_out['cluster'].values, [1, 1, 1, 1, 1, 1, 1, 1])
+        df_out = cluster.cluster(df, 'individual_var', group_var='group_var',
+                                 time_var=['time_var1'], sparse=sparse,
+                                 min_weight=2, time_weight=0)
+        npt.assert_equal(df_out['cluster'].values, [1, 2, 2, 3, 1, 2, 2, 3])
+
+
 def test_cluster_by_time():
     df1 = pd.DataFrame({'individual_var': [1, 200, 3, 100, 1, 200, 3, 100],
                         'time_var1': pd.to_datetime(['2001-01-13',
@@ -92,6 +144,10 @@ def test_cluster_by_time():
     true_T = np.array([[0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
     npt.assert_equal(T, true_T)
 
+    T = cluster.time_co_occurrence(df1, 'individual_var', ['time_var1'],
+                                   sparse=True)
+    npt.assert_equal(T.toarray(), true_T)
+
     # The first test-case uses only one time variable to establish linkage:
     df1_out = cluster.cluster(df1, 'individual_var', time_var=['time_var1'])
     true_df1_out = pd.DataFrame({'individual_var': [1, 200, 3, 100,
@@ -151,6 +207,60 @@ def test_cluster_by_time():
                            true_df1_out.sort_index(axis=1))
 
 
+def test_time_co_occurrence_window():
+    # Times within a window of time_delta co-occur. Missing times never do:
+    df = pd.DataFrame({'individual_var': [1, 2, 3, 4, 5],
+                       'time_var1': pd.to_datetime(['2001-01-13',
+                                                    '2001-01-14',
+                                                    '2001-01-16',
+                                                    np.nan,
+                                                    '2001-01-12'])})
+    T = cluster.time_co_occurrence(df, 'individual_var', ['time_var1'],
+                                   time_unit='D', time_delta=1)
+    true_T = np.array([[0, 1, 0, 0, 1],
+                       [1, 0, 0, 0, 0],
+                       [0, 0, 0, 0, 0],
+                       [0, 0, 0, 0, 0],
+                       [1, 0, 0, 0, 0]])
+    npt.assert_equal(T, true_T)
+
+    T = cluster.time_co_occurrence(df, 'individual_var', ['time_var1'],
+                                   time_unit='D', time_delta=3)
+    true_T = np.array([[0, 1, 1, 0, 1],
+                       [1, 0, 1, 0, 1],
+                       [1, 1, 0, 0, 0],
+                       [0, 0, 0, 0, 0],
+                       [1, 1, 0, 0, 0]])
+    npt.assert_equal(T, true_T)
+
+    # Processing the enrollments in chunks gives the same co-occurrences:
+    for chunk_size in [1, 2, 10]:
+        T = cluster.time_co_occurrence(df, 'individual_var', ['time_var1'],
+                                       time_unit='D', time_delta=3,
+                                       chunk_size=chunk_size)
+        npt.assert_equal(T, true_T)
+
+
+def test_time_co_occurrence_chunks():
+    # With many chunks, pairs found in different chunks are merged into the
+    # same co-occurrences as when all pairs are found at once:
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({'individual_var': rng.randint(0, 500, 3000),
+                       'time_var1': (pd.to_datetime('2001-01-01') +
+                                     pd.to_timedelta(rng.randint(0, 300,
+                                                                 3000),
+                                                     unit='D'))})
+    T = cluster.time_co_occurrence(df, 'individual_var', ['time_var1'],
+                                   time_unit='D', time_delta=2, sparse=True)
+    assert T.nnz > 0
+    for chunk_size in [1, 17, 1000]:
+        T_chunks = cluster.time_co_occurrence(df, 'individual_var',
+                                              ['time_var1'], time_unit='D',
+                                              time_delta=2, sparse=True,
+                                              chunk_size=chunk_size)
+        assert (T_chunks != T).nnz == 0
+
+
 def test_cluster_w_both():
     df1 = pd.DataFrame({'individual_var': [1, 200, 3, 100, 1, 200, 30, 1000],
                         'group_var': [1, 1, 4, 5, 1, 1, 3, 3],
@@ -198,6 +308,12 @@ def test_cluster_w_both():
     pdt.assert_frame_equal(df1_out.sort_index(axis=1),
                            true_df1_out.sort_index(axis=1))
 
+    # The same clusters are found with a sparse graph:
+    df1_out = cluster.cluster(df1, 'individual_var', time_var=['time_var1'],
+                              group_var='group_var', sparse=True)
+    pdt.assert_frame_equal(df1_out.sort_index(axis=1),
+                           true_df1_out.sort_index(axis=1))
+
 
 def test_cluster_w_nulls():
     df1 = pd.DataFrame({'individual_var': [1, 200, 3, 100, 1, 200, 30, 1000],
@@ -245,3 +361,48 @@ def test_cluster_w_nulls():
 
     pdt.assert_frame_equal(df1_out.sort_index(axis=1),
                            true_df1_out.sort_index(axis=1))
+
+    # The same clusters are found with a sparse graph:
+    df1_out = cluster.cluster(df1, 'individual_var', time_var=['time_var1'],
+                              group_var='group_var', sparse=True)
+    pdt.assert_frame_equal(df1_out.sort_index(axis=1),
+                           true_df1_out.sort_index(axis=1))
+
+
+def test_cluster_state():
+    df = pd.DataFrame({'individual_var': [1, 200, 3, 100, 1, 200, 30, 1000],
+                       'group_var': [1, 1, 4, 5, 1, 1, 3, 3],
+                       'time_var1': pd.to_datetime(['2001-01-13',
+                                                    '2001-01-13',
+                                                    '1999-06-10',
+                                                    '1999-06-10',
+                                                    '2001-01-13',
+                                                    '2001-01-13',
+                                                    '2003-06-10',
+                                                    '2003-06-10'])})
+    true_cluster = [1, 1, 2, 2, 1, 1, 3, 3]
+
+    state = cluster.make_cluster_state('individual_var',
+                                       group_var='group_var',
+                                       time_var=['time_var1'])
+    # Add the enrollments in two batches, saving the state in between:
+    state = cluster.update_cluster_state(state, df.iloc[:5])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fname = op.join(temp_dir, 'state.pkl')
+        cluster.save_cluster_state(state, fname)
+        state = cluster.load_cluster_state(fname)
+    df_out = cluster.get_clusters(state, df.iloc[:5].copy())
+    npt.assert_equal(df_out['cluster'].values, true_cluster[:5])
+
+    state = cluster.update_cluster_state(state, df.iloc[5:])
+    df_out = cluster.get_clusters(state, df.copy())
+    npt.assert_equal(df_out['cluster'].values, true_cluster)
+
+    # A new enrollment can merge existing clusters:
+    df_new = pd.DataFrame({'individual_var': [2000, 2000],
+                           'group_var': [4, 3],
+                           'time_var1': pd.to_datetime(['2005-01-01',
+                                                        '2005-01-01'])})
+    state = cluster.update_cluster_state(state, df_new)
+    df_out = cluster.get_clusters(state, pd.concat([df, df_new]))
+    npt.assert_equal(df_out['cluster'].values, [1, 1, 2, 2, 1, 1, 2, 2, 2, 2])
@@ -80,6 +80,20 @@ def test_read_table():
 
     temp_csv_file.close()
 
+    # test that columns_to_drop are skipped even when the header has the
+    # unicode 'zero width no-break space character' in it
+    temp_csv_file = tempfile.NamedTemporaryFile(mode='w')
+    temp_csv_file.write('\ufeffdrop1,id,\ufeffcateg1,\ufeffdrop2\n' +
+                        '1,11,0,2\n3,12,8,4\n')
+    temp_csv_file.seek(0)
+    df = pp.read_table({'2011': temp_csv_file.name},
+                       columns_to_drop=['drop1', 'drop2'],
+                       categorical_var=['categ1'],
+                       duplicate_check_columns=['id'])
+    df_test = pd.DataFrame({'id': [11, 12], 'categ1': [0, np.nan]})
+    pdt.assert_frame_equal(df, df_test)
+    temp_csv_file.close()
+
     # test error checking
     with pytest.raises(ValueError):
         pp.read_table(file_spec,
@@ -90,6 +104,113 @@ def test_read_table():
         pp.read_table('test', data_dir=None, paths=None)
 
 
+def test_read_table_parallel():
+    """Test that reading files in parallel matches reading them serially."""
+    temp_csv_files = [tempfile.NamedTemporaryFile(mode='w') for i in range(3)]
+    for i, temp_csv_file in enumerate(temp_csv_files):
+        df = pd.DataFrame({'id': [1, 2, 3 + i],
+                           'time1': ['2001-01-13', '2004-05-21',
+                                     '2003-06-1%d' % i],
+                           'drop1': [2, 3, 4], 'categ1': [0, 8, i]})
+        df.to_csv(temp_csv_file, index=False)
+        temp_csv_file.seek(0)
+
+    file_spec = {str(2011 + i): f.name for i, f in enumerate(temp_csv_files)}
+    kwargs = dict(columns_to_drop=['drop1'], categorical_var=['categ1'],
+                  time_var=['time1'], duplicate_check_columns=['id'])
+    df_serial = pp.read_table(file_spec, **kwargs)
+    assert df_serial.shape == (5, 3)
+
+    for executor in ['thread', 'process']:
+        for n_jobs in [2, 0]:
+            df = pp.read_table(file_spec, n_jobs=n_jobs, executor=executor,
+                               **kwargs)
+            pdt.assert_frame_equal(df, df_serial)
+
+    with pytest.raises(ValueError):
+        pp.read_table(file_spec, n_jobs=2, executor='gpu', **kwargs)
+
+    for temp_csv_file in temp_csv_files:
+        temp_csv_file.close()
+
+
+def test_read_table_dtype():
+    """Test that read_table applies an explicit dtype schema."""
+    temp_csv_files = [tempfile.NamedTemporaryFile(mode='w') for i in range(2)]
+    df_list = [pd.DataFrame({'id': [1, 2], 'categ1': [0, 8],
+                             'categ2': [1, 99], 'name': ['AAA', 'BBB']}),
+               pd.DataFrame({'id': [3, 4], 'categ1': [99, 1],
+                             'categ2': [8, 0], 'name': ['CCC', 'AAA']})]
+    for df, temp_csv_file in zip(df_list, temp_csv_files):
+        df.to_csv(temp_csv_file, index=False)
+        temp_csv_file.seek(0)
+
+    file_spec = {'2011': temp_csv_files[0].name,
+                 '2012': temp_csv_files[1].name}
+    df = pp.read_table(file_spec, categorical_var=['categ1', 'categ2'],
+                       dtype={'categ1': 'Int8', 'categ2': 'category',
+                              'name': 'category'},
+                       duplicate_check_columns=['id'])
+
+    df_test = pd.DataFrame({'id': [3, 4, 1, 2],
+                            'categ1': pd.array([pd.NA, 1, 0, pd.NA],
+                                               dtype='Int8'),
+                            'categ2': pd.Categorical([np.nan, '0', '1',
+                                                      np.nan]),
+                            'name': pd.Categorical(['CCC', 'AAA', 'AAA',
+                                                    'BBB'])})
+    df_test.index = pd.Int64Index([0, 1, 0, 1])
+    pdt.assert_frame_equal(df, df_test, check_categorical=False)
+    assert df['name'].dtype == 'category'
+    assert list(df['categ2'].cat.categories) == ['0', '1']
+
+    # 'string' columns hold the codes as text too
+    df = pp.read_table(file_spec, categorical_var=['categ2'],
+                       dtype={'categ2': 'string'},
+                       duplicate_check_columns=['id'])
+    assert df['categ2'].dtype == 'string'
+    assert df['categ2'].isna().tolist() == [True, False, False, True]
+
+    for temp_csv_file in temp_csv_files:
+        temp_csv_file.close()
+
+
+def test_split_rows_to_columns():
+    df = pd.DataFrame({'id': [11, 11, 11, 12, 12, 13],
+                       'stage': [0, 0, 1, 0, 1, 0],
+                       'value': [1, 2, 3, 4, 5, 6]})
+    df_wide = pp.split_rows_to_columns(df, 'stage',
+                                       {0: '_entry', 1: '_exit'}, 'id')
+    # Several rows for the same category are combined with all the rows of
+    # the other categories (as in an outer merge):
+    df_test = pd.DataFrame({'id': [11, 11, 12, 13],
+                            'value_entry': [1, 2, 4, 6],
+                            'value_exit': [3, 3, 5, np.nan]})
+    pdt.assert_frame_equal(df_wide, df_test)
+
+    # Split by two category columns at once:
+    df = pd.DataFrame({'id': [11, 11, 11, 11, 12],
+                       'stage': [0, 0, 1, 1, 0],
+                       'type': [5, 6, 5, 6, 5],
+                       'value': [0, 1, 1, 1, 0]})
+    df_wide = pp.split_rows_to_columns(df, ['stage', 'type'],
+                                       [{0: '_entry', 1: '_exit'},
+                                        {5: '_a', 6: '_b'}], ['id'])
+    df_test = pd.DataFrame({'id': [11, 12],
+                            'value_entry_a': [0, 0],
+                            'value_entry_b': [1, np.nan],
+                            'value_exit_a': [1, np.nan],
+                            'value_exit_b': [1, np.nan]})
+    pdt.assert_frame_equal(df_wide, df_test)
+
+    with pytest.raises(TypeError):
+        pp.split_rows_to_columns(df, ('stage', 'type'),
+                                 {0: '_entry', 1: '_exit'}, 'id')
+    with pytest.raises(TypeError):
+        pp.split_rows_to_columns(df, ['stage', 'type'],
+                                 {0: '_entry', 1: '_exit'}, 'id')
+
+
 def test_read_entry_exit():
     temp_csv_file = tempfile.NamedTemporaryFile(mode='w')
     df_init = pd.DataFrame({'id': [11, 11, 12],
@@ -796,11 +917,11 @@ def test_merge():
                           'income': income_meta_file,
                           'project': project_meta_file}
 
-        for name_exclusion in [False, True]:
+        for name_exclusion, n_jobs in [(False, 1), (True, 1), (False, -1)]:
 
             df = pp.merge_tables(meta_files=metadata_files,
                                 data_dir=temp_dir, paths=paths, groups=False,
-                                name_exclusion=name_exclusion)
+                                name_exclusion=name_exclusion, n_jobs=n_jobs)
 
             df_test = pd.DataFrame({'personID': [1, 2, 3, 4],
                                     'first_name':["AAA", "noname",
@@ -854,4 +975,30 @@ def test_merge():
             # sort because column order is not assured because started with dicts
             df = df.sort_index(axis=1)
             df_test = df_test.sort_index(axis=1)
-            pdt.assert_frame_equal(df, df_test)
\ No newline at end of file
+            pdt.assert_frame_equal(df, df_test)
+
+        # Two "counties" with the same data
+        counties = {c: {'data_dir': temp_dir, 'paths': paths}
+                    for c in ['county_a', 'county_b']}
+        for n_jobs in [1, 2]:
+            df = pp.merge_counties(counties, meta_files=metadata_files,
+                                   groups=False, n_jobs=n_jobs)
+            df_county = df[df['county'] == 'county_b'].drop('county', axis=1)
+            df_county = df_county.reset_index(drop=True).sort_index(axis=1)
+            pdt.assert_frame_equal(df_county, df_test)
+            assert_equal(list(df['county']), ['county_a'] * 4 +
+                         ['county_b'] * 4)
+
+        # Partitioned output, read back as one table:
+        pytest.importorskip('pyarrow')
+        output_dir = op.join(temp_dir, 'merged')
+        fnames = pp.merge_counties(counties, meta_files=metadata_files,
+                                   groups=False, output_dir=output_dir)
+        assert sorted(fnames.keys()) == ['county_a', 'county_b']
+        df_parquet = pd.read_parquet(output_dir)
+        assert_equal(list(df_parquet['county'].astype(str)),
+                     ['county_a'] * 4 + ['county_b'] * 4)
+        df_county = df_parquet[df_parquet['county'] == 'county_b']
+        df_county = df_county.drop('county', axis=1).reset_index(drop=True)
+        pdt.assert_frame_equal(df_county.sort_index(axis=1), df_test,
+                               check_dtype=False)
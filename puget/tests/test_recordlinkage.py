@@ -1,7 +1,10 @@
 import numpy as np
 import pandas as pd
 import pandas.util.testing as pdt
-from puget.recordlinkage import link_records
+import numpy.testing as npt
+from puget.recordlinkage import (link_records, compare_strings, compare_dates,
+                                 block_pairs, normalize_names,
+                                 block_and_match)
 
 def test_linkage():
     link_list = [{'block_variable': 'lname',
@@ -166,3 +169,116 @@ def test_linkage():
     test_df = prelink_ids.copy()
     test_df["linkage_PID"] = [1, 1, 1]
     pdt.assert_frame_equal(test_df, linked)
+
+
+def test_compare():
+    values = np.array(["QWERT", "QWETR", "ASDF"], dtype=object)
+    # Each distinct pair of strings is compared once:
+    c = compare_strings(np.array([0, 0, 0, -1, 0]), np.array([0, 1, 2, 0, 1]),
+                        values)
+    np.testing.assert_equal(c, [1, 1, 0, np.nan, 1])
+    c = compare_strings(np.array([0, 0]), np.array([1, 2]), values,
+                        threshold=None)
+    assert 0.85 < c[0] < 1
+    assert c[1] < 0.85
+
+    c = compare_dates(pd.to_datetime(["1990-02-01", "1990-02-01",
+                                      "1990-06-03", "1990-06-03", None]),
+                      pd.to_datetime(["1990-02-01", "1990-01-02",
+                                      "1990-07-03", "1991-07-03",
+                                      "1990-02-01"]))
+    np.testing.assert_equal(c, [1, 0.5, 0.5, 0, np.nan])
+
+
+def test_block_pairs():
+    df = pd.DataFrame({'lname': ["SMITH", "SMITH", "SMYTH", "SMITH", np.nan,
+                                 "SMITH", "JONES"],
+                       'dob_year': [1990, 1990, 1990, 1991, 1990, 1991,
+                                    1990]})
+    pairs = block_pairs(df, 'lname')
+    assert sorted(pairs.tolist()) == [(1, 0), (3, 0), (3, 1), (5, 0), (5, 1),
+                                      (5, 3)]
+    # Compound keys:
+    pairs = block_pairs(df, ['lname', 'dob_year'])
+    assert sorted(pairs.tolist()) == [(1, 0), (5, 3)]
+    # Neighbouring keys (in sorted order) are compared too:
+    pairs = block_pairs(df, 'lname', blocking='sortedneighbourhood',
+                        window=3)
+    assert sorted(pairs.tolist()) == [(1, 0), (2, 0), (2, 1), (3, 0), (3, 1),
+                                      (3, 2), (5, 0), (5, 1), (5, 2), (5, 3),
+                                      (6, 0), (6, 1), (6, 3), (6, 5)]
+    # Large blocks are split:
+    pairs = block_pairs(df, 'lname', max_block_size=3,
+                        sub_block_variable='dob_year')
+    assert sorted(pairs.tolist()) == [(1, 0), (5, 3)]
+    pairs = block_pairs(df, 'lname', max_block_size=1,
+                        sub_block_variable='dob_year')
+    assert sorted(pairs.tolist()) == [(1, 0), (5, 3)]
+    pairs = block_pairs(df, 'lname', max_block_size=3)
+    assert sorted(pairs.tolist()) == [(1, 0), (3, 1), (5, 3)]
+
+
+def test_normalize_names():
+    df = pd.DataFrame({'lname': ["Smith", "SMITH ", "smyth", np.nan,
+                                 "Refused", ""],
+                       'fname': ["Jo", "JO", "Joe", "Jo", "Jo", "Jo"]})
+    df = normalize_names(df)
+    npt.assert_equal(list(df['lname_clean'].astype(object)),
+                     ["SMITH", "SMITH", "SMYTH", np.nan, np.nan, np.nan])
+    npt.assert_equal(list(df['lname_soundex'].astype(object)),
+                     ["S530", "S530", "S530", np.nan, np.nan, np.nan])
+    npt.assert_equal(list(df['fname_clean'].astype(object)),
+                     ["JO", "JO", "JOE", "JO", "JO", "JO"])
+    assert df['lname_nysiis'].dtype == 'category'
+
+    # Phonetic codes can be used for blocking when linking:
+    link_list = [{'block_variable': 'lname_soundex',
+                  'match_variables': {"fname_clean": "string"}}]
+    linked = link_records(df.drop(list(df.columns[2:]), axis=1), link_list,
+                          name_columns=["lname", "fname"])
+    npt.assert_equal(list(linked["linkage_PID"]), [1, 1, 1, 2, 3, 4])
+
+
+def test_chunks():
+    prelink_ids = pd.DataFrame(data={'ssn_as_str': ['123456789', '123456789',
+                                                    "246801357", "246801357",
+                                                    np.nan],
+                                     'lname': ["QWERT", "QWERT", "ASDF",
+                                               "ASDF", "QWERT"],
+                                     'fname': ["QWERT", "QWERT", "QWERT",
+                                               "ASDF", "QWERT"],
+                                     'dob': ["1990-02-01", "1990-02-01",
+                                             "1990-02-01", "1977-03-04",
+                                             "1990-01-02"]})
+    prelink_ids["dob"] = pd.to_datetime(prelink_ids["dob"])
+    comparison_dict = {"fname": "string", "ssn_as_str": "string",
+                       "dob": "date"}
+    features = block_and_match(prelink_ids, 'lname', comparison_dict)
+    for chunk_size, n_jobs in [(1, 1), (2, 2)]:
+        chunked = block_and_match(prelink_ids, 'lname', comparison_dict,
+                                  chunk_size=chunk_size, n_jobs=n_jobs)
+        pdt.assert_frame_equal(chunked, features)
+        # Only keep the matches:
+        chunked = block_and_match(prelink_ids, 'lname', comparison_dict,
+                                  chunk_size=chunk_size, n_jobs=n_jobs,
+                                  matches_only=True)
+        pdt.assert_frame_equal(chunked, features[features["match"]])
+
+    link_list = [{'block_variable': 'lname',
+                  'match_variables': {"fname": "string",
+                                      "ssn_as_str": "string",
+                                      "dob": "date"}},
+                 {'block_variable': 'ssn_as_str',
+                  'match_variables': {"fname": "string",
+                                      "lname": "string",
+                                      "dob": "date"}}]
+    linked = link_records(prelink_ids.copy(), link_list)
+    npt.assert_equal(list(linked["linkage_PID"]), [1, 1, 2, 3, 1])
+    for chunk_size, n_jobs in [(1, 1), (2, 2)]:
+        chunked = link_records(prelink_ids.copy(), link_list,
+                               chunk_size=chunk_size, n_jobs=n_jobs)
+        pdt.assert_frame_equal(chunked, linked)
+    # Many more chunks than cores:
+    chunked = link_records(prelink_ids.copy(), link_list, chunk_size=1,
+                           n_jobs=-1)
+    pdt.assert_frame_equal(chunked, linked)
@@ -1,9 +1,12 @@
 import puget.utils as pu
 import puget
+import os
 import os.path as op
+import numpy as np
 import pandas as pd
 import pandas.util.testing as pdt
 import tempfile
+import pytest
 
 
 def test_merge_destination():
@@ -44,3 +47,41 @@ def test_merge_destination():
     pdt.assert_frame_equal(df_merge, df_test)
 
     TF.close()
+
+
+def test_n_workers():
+    # The number of workers doesn't grow with the number of tasks:
+    n_cores = os.cpu_count() or 1
+    assert pu.n_workers(-1, 10000) == n_cores
+    assert pu.n_workers(10 * n_cores, 10000) == n_cores
+    assert pu.n_workers(-1, 1) == 1
+    assert pu.n_workers(1, 10000) == 1
+    assert pu.n_workers(2, 0) == 1
+
+
+def test_run_in_pool():
+    tasks = [((i,), {'exp': 2}) for i in range(5)]
+    for executor in ['thread', 'process']:
+        for n_jobs in [1, 2, -1]:
+            assert pu.run_in_pool(pow, tasks, n_jobs=n_jobs,
+                                  executor=executor) == [0, 1, 4, 9, 16]
+    with pytest.raises(ValueError):
+        pu.run_in_pool(pow, tasks, executor='gpu')
+
+
+def test_window_pairs():
+    values = np.array([5, -3, 0, 7, 6, 30])
+    expected = {(0, 3), (0, 4), (3, 4), (1, 2)}
+    for chunk_size in [None, 1, 2]:
+        pairs = set()
+        for first, second in pu.window_pairs(values, 3,
+                                             chunk_size=chunk_size):
+            pairs.update(zip(first, second))
+        assert {tuple(sorted(p)) for p in pairs} == expected
+    # Invalid values are never paired:
+    first, second = next(pu.window_pairs(values, 3, valid=values >= 0))
+    assert {tuple(sorted(p)) for p in zip(first, second)} == \
+        {(0, 3), (0, 4), (3, 4)}
+    # There is always at least one (maybe empty) chunk:
+    first, second = next(pu.window_pairs(values, 3, valid=values > 100))
+    assert first.shape[0] == second.shape[0] == 0
@@ -1,6 +1,8 @@
 import pandas as pd
+import os
 import os.path as op
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from puget.data import DATA_PATH
 
 METADATA = op.join(DATA_PATH, 'metadata')
@@ -94,3 +96,127 @@ def stringify_ssn(ssn):
     else:
         ssn_str = str(int(ssn))
         return ssn_str
+
+
+def n_workers(n_jobs, n_tasks):
+    """
+    Number of workers to use for n_tasks tasks.
+
+    Parameters
+    ----------
+    n_jobs : int
+        number of workers asked for. Values < 1 use all the cores
+
+    n_tasks : int
+        number of tasks to run
+
+    Returns
+    -------
+    n_jobs, capped at the number of cores and at n_tasks (and at least 1)
+    """
+    n_cores = os.cpu_count() or 1
+    if n_jobs < 1:
+        n_jobs = n_cores
+    return max(min(n_jobs, n_cores, n_tasks), 1)
+
+
+def run_in_pool(func, tasks, n_jobs=1, executor='process', initializer=None,
+                initargs=()):
+    """
+    Run func(*args, **kwargs) for the (args, kwargs) of each task, on a pool
+    of n_workers(n_jobs, len(tasks)) workers, or one task after another if
+    that is 1.
+
+    Parameters
+    ----------
+    func : callable
+        function to run. With executor='process' it has to be importable
+        (defined at the top level of a module)
+
+    tasks : list
+        (args, kwargs) tuples, one per task
+
+    n_jobs : int
+        number of workers (see n_workers). Default is 1
+
+    executor : string
+        'thread' or 'process': the kind of worker pool. Default is 'process'
+
+    initializer, initargs :
+        passed to the pool, to run initializer(*initargs) once in each
+        worker. Not called when the tasks run one after another
+
+    Returns
+    -------
+    list with the output of each task, in the order of tasks
+    """
+    if executor == 'thread':
+        pool_class = ThreadPoolExecutor
+    elif executor == 'process':
+        pool_class = ProcessPoolExecutor
+    else:
+        raise ValueError("executor must be 'thread' or 'process'")
+
+    max_workers = n_workers(n_jobs, len(tasks))
+    if max_workers == 1:
+        return [func(*args, **kwargs) for args, kwargs in tasks]
+
+    with pool_class(max_workers=max_workers, initializer=initializer,
+                    initargs=initargs) as pool:
+        futures = [pool.submit(func, *args, **kwargs)
+                   for args, kwargs in tasks]
+        return [f.result() for f in futures]
+
+
+def window_pairs(values, window, valid=None, chunk_size=None):
+    """
+    Find all pairs of values that are at most window apart.
+
+    The values are sorted and, for each one, all the larger values within the
+    window are found with a binary search, so the cost is O(n log n + number
+    of pairs) rather than O(n^2).
+
+    Parameters
+    ----------
+    values : int array
+        The values to pair
+
+    window : int
+        The largest difference between paired values
+
+    valid : boolean array, optional
+        Only the values where this is True are paired. Default: None, which
+        pairs all the values.
+
+    chunk_size : int, optional
+        If provided, the pairs are generated for chunks of this many
+        (value-sorted) first members at a time. Second members can be beyond
+        the end of the chunk, up to window larger. Default: None, which
+        implies all pairs are generated at once.
+
+    Yields
+    -------
+    Two arrays with the positions (in values) of the first and second member
+    of each pair (for each chunk, and at least once). Each pair appears once,
+    and positions are not paired with themselves.
+    """
+    if valid is None:
+        valid = np.ones(values.shape[0], dtype=bool)
+    valid = np.flatnonzero(valid)
+    order = valid[np.argsort(values[valid], kind='mergesort')]
+    sorted_values = values[order]
+    # For the value at sorted position i, all values within the window are
+    # at sorted positions i + 1 ... ends[i] - 1:
+    ends = np.searchsorted(sorted_values, sorted_values + window, side='right')
+    n_pairs = ends - np.arange(sorted_values.shape[0]) - 1
+    if chunk_size is None:
+        chunk_size = max(sorted_values.shape[0], 1)
+    for start in range(0, max(sorted_values.shape[0], 1), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        first = np.repeat(np.arange(sorted_values.shape[0])[chunk],
+                          n_pairs[chunk])
+        # Position of each pair within the run of pairs of its first member:
+        run_starts = np.cumsum(n_pairs[chunk]) - n_pairs[chunk]
+        second = (np.arange(first.shape[0]) -
+                  np.repeat(run_starts, n_pairs[chunk]) + first + 1)
+        yield order[first], order[second]